@@ -1,4 +1,5 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Query, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel
 import asyncio
 import logging
 from data.exception import *
@@ -11,6 +12,23 @@ from database.wrappers import Lobby
 app = FastAPI()
 
 
+class Pick(BaseModel):
+    agent_id: int
+    stone: int
+
+
+def batch_results(results: dict) -> dict:
+    """
+    Turns results of a batch handler into the results of every agent: a result or an error of the agent.
+    """
+    return {
+        agent_id: {"status": "error", "code": 400, "message": str(result)}
+        if isinstance(result, ActionException) else
+        {"status": "success", "code": 200, "result": result}
+        for agent_id, result in results.items()
+    }
+
+
 @app.on_event("startup")
 async def startup():
     init_exceptions()
@@ -159,8 +177,10 @@ async def pick_stone(
 ):
     """
     Запрос о выборе данным агентом данного камня. Если выбор произошёл успешно, то ответ на этот
-    запрос вернётся только когда будет доступный следующий ход или раунд закончится. 
-    При этом в ответе на запрос будет указано начался ли следующий ход или раунд закончился.
+    запрос вернётся сразу после окончания хода.
+    При этом в ответе на запрос будет указано начался ли следующий ход или раунд закончился,
+    а в поле `result` – итог хода: `round_ended` (закончился ли раунд), `removed_stones` (номера
+    убранных за ход камней в том виде, в каком их видит агент) и `stones_left` (сколько камней осталось).
 
     Параметры:
     - agent_id – ID агента, который должен выбрать камень;
@@ -181,11 +201,12 @@ async def pick_stone(
             "code": 500,
             "message": _UNKNOWN_ERROR
         }
-    new_move = "Начался новый ход." if res else "Раунд закончен."
+    new_move = "Раунд закончен." if res['round_ended'] else "Начался новый ход."
     return {
         "status": "success",
         "code": 200,
-        "message": "Агент выбрал камень. " + new_move
+        "message": "Агент выбрал камень. " + new_move,
+        "result": res
     }
     
     
@@ -216,4 +237,136 @@ async def wait_round_start(agent_id: int, timeout: int = 600):
             "status": "error",
             "code": 500,
             "message": _UNKNOWN_ERROR
-        }
\ No newline at end of file
+        }
+
+
+@app.post("/game/batch/pick_stone/")
+async def pick_stones(
+    lobby_id: int,
+    picks: list[Pick]
+):
+    """
+    Выбор камней сразу несколькими агентами одного лобби. Как и `/game/pick_stone/`, ответ возвращается
+    после окончания хода (или сразу, если ни один выбор не удался).
+    В поле `result` для каждого агента указан итог хода в том же виде, что и у `/game/pick_stone/`, либо ошибка его выбора.
+
+    Пример тела запроса:
+    ```
+    [{"agent_id": 1, "stone": 2}, {"agent_id": 2, "stone": 0}]
+    ```
+
+    Параметры:
+    - lobby_id – ID лобби, в котором играют агенты;
+    - тело запроса – список выборов: ID агента `agent_id` и номер камня `stone` (0, если агент отходит от камней),
+      каждый агент указывается не больше одного раза.
+    """
+    try:
+        res = await hnd.pick_stones(lobby_id, [(pick.agent_id, pick.stone) for pick in picks])
+    except ActionException as ex:
+        return {
+            "status": "error",
+            "code": 400,
+            "message": str(ex)
+        }
+    except Exception as ex:
+        return {
+            "status": "error",
+            "code": 500,
+            "message": _UNKNOWN_ERROR
+        }
+    return {
+        "status": "success",
+        "code": 200,
+        "result": batch_results(res)
+    }
+
+
+@app.get("/game/batch/get_game_info/")
+async def get_game_infos(
+    lobby_id: int,
+    agent_ids: list[int] = Query()
+):
+    """
+    Возвращает информацию об окружающей среде сразу для нескольких агентов одного лобби.
+    В поле `result` для каждого агента указано поле в том же виде, что и у `/game/get_game_info/`, либо ошибка.
+
+    Параметры:
+    - lobby_id – ID лобби, в котором играют агенты;
+    - agent_ids – ID агентов, для которых нужно получить информацию о поле (параметр повторяется: `agent_ids=1&agent_ids=2`).
+    """
+    try:
+        res = await hnd.get_game_environments(lobby_id, agent_ids)
+    except ActionException as ex:
+        return {
+            "status": "error",
+            "code": 400,
+            "message": str(ex)
+        }
+    except Exception as ex:
+        return {
+            "status": "error",
+            "code": 500,
+            "message": _UNKNOWN_ERROR
+        }
+    return {
+        "status": "success",
+        "code": 200,
+        "result": batch_results(res)
+    }
+
+
+@app.websocket("/game/ws/")
+async def agent_stream(
+    websocket: WebSocket,
+    agent_id: int
+):
+    """
+    Поток событий игры для агента через WebSocket, заменяющий опрос `/game/get_game_info/` и ожидание ответа `/game/pick_stone/`.
+
+    Сервер присылает JSON-сообщения с полем `type`:
+    - `connected` – агент подключён: `lobby_id`, `status` лобби и номер раунда `round`;
+    - `round_started` – начался раунд `round`, на поле `stones_left` камней;
+    - `move_started` – начался ход `move`, в поле `field` – поле в том же виде, что и у `/game/get_game_info/`;
+    - `move_ended` – итог хода в том же виде, что и у `/game/pick_stone/`;
+    - `round_ended` – раунд `round` закончился;
+    - `game_ended` – игра закончилась, после этого соединение закрывается;
+    - `picked` – выбор агента принят;
+    - `error` – ошибка, текст в поле `message`.
+
+    Выбор камня отправляется в то же соединение: `{"action": "pick", "stone": 2}` (0, если агент отходит от камней).
+    Итог хода приходит сообщением `move_ended`.
+    Если агент не успевает читать события, приходит `error` и соединение закрывается.
+
+    Параметры:
+    - agent_id – ID агента, находящегося в лобби.
+    """
+    await websocket.accept()
+
+    async def send_events():
+        async for event in hnd.agent_events(agent_id):
+            await websocket.send_json(event)
+
+    async def receive_picks():
+        while True:
+            message = await websocket.receive_json()
+            try:
+                await websocket.send_json(await hnd.handle_message(agent_id, message))
+            except ActionException as ex:
+                await websocket.send_json({"type": "error", "message": str(ex)})
+
+    tasks = [asyncio.create_task(send_events()), asyncio.create_task(receive_picks())]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    except WebSocketDisconnect:
+        return
+    except ActionException as ex:
+        await websocket.send_json({"type": "error", "message": str(ex)})
+    except Exception as ex:
+        logging.error(f'Stream of agent {agent_id} failed: {ex}')
+        await websocket.send_json({"type": "error", "message": _UNKNOWN_ERROR})
+    finally:
+        for task in tasks:
+            task.cancel()
+    await websocket.close()
@@ -1,16 +1,30 @@
 import asyncio
 import logging
+from typing import AsyncIterator
+
+from aiogram.methods import SendMessage
 
 from app import messages
-from app.game import bot, dp
+from app.broadcast import broadcaster
+from app.game import bot
 from database import wrappers as wr
 from data.exception import (
     _ACTION_OUT_OF_LOBBY, 
     _NO_SUCH_LOBBY, 
-    _GAME_IS_NOT_RUNNING
+    _NO_SUCH_STONE,
+    _UNKNOWN_ACTION,
+    _MOVE_NOT_ENDED,
+    _REPEATED_AGENT,
+    _EVENTS_OVERFLOW,
+    _NO_SUCH_ELEMENT,
+    _GAME_IS_NOT_RUNNING,
+    _LOBBY_FINISHED
 )
 
 
+# how long a pick may wait for the end of the move beyond its maximal duration, in seconds
+_MOVE_END_MARGIN = 10
+
 
 async def enter_lobby(
     lobby_id: int,
@@ -24,12 +38,13 @@ async def enter_lobby(
         raise wr.ActionException(_NO_SUCH_LOBBY)
     lobby_users = await lobby.users()
     num_players = lobby.number_of_players()
-    for other_user in lobby_users:
-        if other_user.id != agent_id:
-            await bot.send_message(
-                chat_id=other_user.id, 
-                text=messages.lobby_entered(num_players, True)
-            )
+    await broadcaster.broadcast(bot, [
+        SendMessage(
+            chat_id=other_user.id, 
+            text=messages.lobby_entered(num_players, True)
+        )
+        for other_user in lobby_users if other_user.id != agent_id
+    ], f'Agent {agent_id} entered lobby {lobby.lobby_id()}')
 
 async def leave_lobby(
     agent_id: int
@@ -44,48 +59,121 @@ async def leave_lobby(
         raise wr.ActionException(_ACTION_OUT_OF_LOBBY)
     lobby_users = await lobby.users()
     num_players = lobby.number_of_players()
-    for other_user in lobby_users:
-        if other_user.id != agent_id:
-            await bot.send_message(
-                chat_id=other_user.id, 
-                text=messages.left_lobby(num_players, True)
-            )
+    await broadcaster.broadcast(bot, [
+        SendMessage(
+            chat_id=other_user.id, 
+            text=messages.left_lobby(num_players, True)
+        )
+        for other_user in lobby_users if other_user.id != agent_id
+    ], f'Agent {agent_id} left lobby {lobby.lobby_id()}')
+
+async def __make_pick(
+    user: wr.User,
+    stone: int
+) -> None:
+    if stone == 0:
+        await user.leave_stone()
+    else:
+        await user.choose_stone(stone)
+
+async def __wait_move_end(
+    lobby: wr.Lobby,
+    move_end: asyncio.Future
+) -> dict:
+    try:
+        return await lobby.wait_move_end(lobby.move_max_duration_ms / 1000 + _MOVE_END_MARGIN, move_end)
+    except asyncio.TimeoutError:
+        raise wr.ActionException(_MOVE_NOT_ENDED)
 
 async def pick_stone(
     agent_id: int,
     stone: int
-) -> bool:
+) -> dict:
     logging.debug(f"Player {agent_id} chose stone {stone}")
     user = await wr.User.add_or_get(agent_id, 'agent')
     lobby = await user.lobby()
     if lobby is None:
         raise wr.ActionException(_ACTION_OUT_OF_LOBBY)
-    picked = dp.update.middleware._middlewares[0].picked()
-    queues = dp.update.middleware._middlewares[0].queues()
+    move_end = lobby.move_waiter()
     try:
-        if stone == 0:
-            await user.leave_stone()
-        else:
-            await user.choose_stone(stone)
-        picked[lobby.lobby_id()] += 1
-        logging.debug(f"Added to counter: {picked[lobby.lobby_id()]}")
+        await __make_pick(user, stone)
+        logging.debug(f"Decided: {lobby.coordinator().num_decided()}")
     except wr.ActionException as ex:
         logging.debug(f'While user {agent_id} tried pick stone {stone}, error occured: {ex}')
         raise ex
-    num_players = lobby.number_of_players()
-    if picked[lobby.lobby_id()] == num_players:
-        logging.debug('Everyone made a choice')
-        queue = queues[lobby.lobby_id()]
-        picked[lobby.lobby_id()] = 0
-        await queue.put('chosen')
-        await asyncio.sleep(5)
-        return lobby.status() != 'waiting'
-    else:
-        while picked[lobby.lobby_id()] != num_players and picked[lobby.lobby_id()] != 0:
-            await asyncio.sleep(1)
-            picked = dp.update.middleware._middlewares[0].picked()
-        await asyncio.sleep(5)
-        return lobby.status() != 'waiting'
+    result = await __wait_move_end(lobby, move_end)
+    return {
+        'round_ended': result['round_ended'],
+        'removed_stones': (await lobby.real_to_fake_stone_name(agent_id, result['removed_stones'])).tolist(),
+        'stones_left': result['stones_left']
+    }
+
+async def __lobby_agents(
+    lobby_id: int,
+    agent_ids: list[int]
+) -> tuple[wr.Lobby, dict[int, wr.User], set[int]]:
+    """
+    Returns the running lobby, users of all the agents and ids of the agents playing in the lobby.
+    """
+    try:
+        lobby = await wr.Lobby.get_lobby(lobby_id)
+    except wr.ActionException:
+        raise wr.ActionException(_NO_SUCH_LOBBY)
+    if lobby.status() != 'started':
+        raise wr.ActionException(_GAME_IS_NOT_RUNNING)
+    users = await wr.User.get_many(agent_ids, 'agent')
+    player_ids = {player.id for player in await lobby.players()}
+    return lobby, users, player_ids
+
+async def pick_stones(
+    lobby_id: int,
+    picks: list[tuple[int, int]]
+) -> dict[int, dict | wr.ActionException]:
+    """
+    Makes picks of many agents of one lobby and waits until the move ends.
+    Returns the result of the move for every agent (as pick_stone does) or the error of its pick.
+    """
+    agent_ids = [agent_id for agent_id, _ in picks]
+    # results are keyed by agent, a second pick of an agent would hide the result of the first one
+    if len(set(agent_ids)) != len(agent_ids):
+        raise wr.ActionException(_REPEATED_AGENT)
+    lobby, users, player_ids = await __lobby_agents(lobby_id, agent_ids)
+    results = {}
+    move_end = lobby.move_waiter()
+    for agent_id, stone in picks:
+        if agent_id not in player_ids:
+            results[agent_id] = wr.ActionException(_ACTION_OUT_OF_LOBBY)
+            continue
+        try:
+            await __make_pick(users[agent_id], stone)
+            results[agent_id] = None
+        except wr.ActionException as ex:
+            logging.debug(f'While user {agent_id} tried pick stone {stone}, error occured: {ex}')
+            results[agent_id] = ex
+    logging.debug(f"Decided: {lobby.coordinator().num_decided()}")
+    if all(result is not None for result in results.values()):
+        return results
+    result = await __wait_move_end(lobby, move_end)
+    for agent_id in results:
+        if results[agent_id] is None:
+            results[agent_id] = {
+                'round_ended': result['round_ended'],
+                'removed_stones': (await lobby.real_to_fake_stone_name(agent_id, result['removed_stones'])).tolist(),
+                'stones_left': result['stones_left']
+            }
+    return results
+
+async def get_game_environments(
+    lobby_id: int,
+    agent_ids: list[int]
+) -> dict[int, dict[int, tuple[int, list[int]]] | wr.ActionException]:
+    """
+    Returns the fields seen by many agents of one lobby, users are resolved and the field is built once.
+    """
+    lobby, users, player_ids = await __lobby_agents(lobby_id, agent_ids)
+    fields = await lobby.fields_for_users([users[agent_id] for agent_id in dict.fromkeys(agent_ids)
+                                           if agent_id in player_ids])
+    return {agent_id: fields.get(agent_id, wr.ActionException(_ACTION_OUT_OF_LOBBY)) for agent_id in agent_ids}
 
 async def get_game_environment(
     agent_id : int
@@ -108,12 +196,81 @@ async def wait_until_start_round(
     logging.debug(f'lobby: {lobby}')
     if lobby is None:
         raise wr.ActionException(_ACTION_OUT_OF_LOBBY)
-    for _ in range(timeout):
-        logging.debug(f'tick: {_}')
+    await lobby.wait_for_status('started', 'finished', timeout=timeout)
+    if lobby.status() == 'finished':
+        raise wr.ActionException(_LOBBY_FINISHED)
+    return lobby.status() == 'started'
+
+async def handle_message(
+    agent_id: int,
+    message: dict
+) -> dict:
+    """
+    Handles a message of an agent received from its stream. The only action is a pick:
+    {"action": "pick", "stone": 2}, it doesn't wait for the end of the move, the result comes as move_ended.
+    """
+    if not isinstance(message, dict) or message.get('action') != 'pick':
+        raise wr.ActionException(_UNKNOWN_ACTION)
+    try:
+        stone = int(message['stone'])
+    except (KeyError, TypeError, ValueError):
+        raise wr.ActionException(_NO_SUCH_STONE)
+    user = await wr.User.add_or_get(agent_id, 'agent')
+    if await user.lobby() is None:
+        raise wr.ActionException(_ACTION_OUT_OF_LOBBY)
+    await __make_pick(user, stone)
+    return {'type': 'picked', 'stone': stone}
+
+async def __move_started(
+    lobby: wr.Lobby,
+    user: wr.User
+) -> dict:
+    try:
+        field = await lobby.field_for_user(user)
+    except wr.ActionException as ex:
+        return {'type': 'error', 'message': str(ex)}
+    return {'type': 'move_started', 'round': lobby.round(), 'move': lobby.move(), 'field': field}
+
+def __move_ended(
+    agent_id: int,
+    event: dict
+) -> dict:
+    namings = event['namings']
+    try:
+        removed_stones = namings.to_fake(agent_id, event['removed_stones']).tolist()
+    except (AttributeError, KeyError):
+        return {'type': 'error', 'message': str(wr.ActionException(_NO_SUCH_ELEMENT))}
+    return {key: value for key, value in event.items() if key != 'namings'} | {'removed_stones': removed_stones}
+
+async def agent_events(
+    agent_id: int
+) -> AsyncIterator[dict]:
+    """
+    Yields the events of the lobby of the agent as the agent sees them, starting with the current state:
+    move_started comes with the field of the agent, move_ended with the removed stones named as the agent
+    sees them in the round of the move. Ends after game_ended or with an error if the agent lags too far behind.
+    """
+    user = await wr.User.add_or_get(agent_id, 'agent')
+    lobby = await user.lobby()
+    if lobby is None:
+        raise wr.ActionException(_ACTION_OUT_OF_LOBBY)
+    events = lobby.events().subscribe()
+    try:
+        yield {'type': 'connected', 'lobby_id': lobby.lobby_id(), 'status': lobby.status(), 'round': lobby.round()}
         if lobby.status() == 'started':
-            logging.debug('round started')
-            return True
-        else:
-            logging.debug('sleeping 1 sec')
-            await asyncio.sleep(1)
-    return False
+            yield await __move_started(lobby, user)
+        while True:
+            event = await events.get()
+            if event['type'] == 'overflow':
+                yield {'type': 'error', 'message': str(wr.ActionException(_EVENTS_OVERFLOW))}
+                return
+            if event['type'] == 'move_started':
+                yield await __move_started(lobby, user)
+            elif event['type'] == 'move_ended':
+                yield __move_ended(agent_id, event)
+            else:
+                yield event
+            if event['type'] == 'game_ended':
+                return
+    finally:
+        lobby.events().unsubscribe(events)
@@ -0,0 +1,121 @@
+"""
+Module providing concurrent delivery of messages to many chats within Telegram rate limits.
+"""
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import TelegramMethod
+
+import asyncio
+import logging
+import os
+import statistics
+import time
+from typing import Any, Optional
+
+# Telegram allows about 30 messages per second overall and about 1 per second in one chat
+GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))
+# a few messages in a row to one chat (e.g. round start and the field) are sent without waiting
+_CHAT_BURST = 3
+MAX_CONCURRENT_SENDS = int(os.getenv('TELEGRAM_MAX_CONCURRENT_SENDS', 20))
+_MAX_ATTEMPTS = 4
+_BACKOFF_BASE = 0.5
+# buckets of chats idle for so long are full again, they are forgotten when there are too many buckets
+_CHAT_BUCKET_TTL = 60
+_MAX_CHAT_BUCKETS = 1000
+
+
+class TokenBucket:
+    """
+    Token bucket where a token is reserved at once and the caller waits until it becomes available,
+    so concurrent senders are served in the order they came without any lock.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.__rate = rate
+        self.__capacity = capacity
+        self.__tokens = capacity
+        self.__updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """
+        Takes a token and returns how many seconds to wait before using it.
+        """
+        now = time.monotonic()
+        self.__tokens = min(self.__capacity, self.__tokens + (now - self.__updated) * self.__rate)
+        self.__updated = now
+        self.__tokens -= 1
+        return 0 if self.__tokens >= 0 else -self.__tokens / self.__rate
+
+    @property
+    def updated(self) -> float:
+        return self.__updated
+
+
+class Broadcaster:
+    """
+    Sends requests to many chats in parallel: at most max_concurrent at once, within the global
+    and per-chat rates. Requests failed because of flood control are retried after the time
+    Telegram asks for, network and server errors are retried with exponential backoff.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 max_concurrent: int = MAX_CONCURRENT_SENDS):
+        self.__global_bucket = TokenBucket(global_rate, global_rate)
+        self.__chat_rate = chat_rate
+        self.__chat_buckets: dict[int, TokenBucket] = {}
+        self.__semaphore = asyncio.Semaphore(max_concurrent)
+
+    def __reserve(self, chat_id: int) -> float:
+        if chat_id not in self.__chat_buckets:
+            if len(self.__chat_buckets) >= _MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                self.__chat_buckets = {chat: bucket for chat, bucket in self.__chat_buckets.items()
+                                       if now - bucket.updated < _CHAT_BUCKET_TTL}
+            self.__chat_buckets[chat_id] = TokenBucket(self.__chat_rate, _CHAT_BURST)
+        return max(self.__global_bucket.reserve(), self.__chat_buckets[chat_id].reserve())
+
+    async def send(self, bot: Bot, method: TelegramMethod) -> Optional[Any]:
+        """
+        Sends one request to the chat of method.chat_id.
+        Returns the result of the request or None if it has not been delivered.
+        """
+        for attempt in range(_MAX_ATTEMPTS):
+            await asyncio.sleep(self.__reserve(method.chat_id))
+            try:
+                async with self.__semaphore:
+                    return await bot(method)
+            except TelegramRetryAfter as e:
+                logging.warning(f'Flood control in chat {method.chat_id}, retrying in {e.retry_after} s')
+                await asyncio.sleep(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logging.warning(f'Failed to send to chat {method.chat_id}: {e}')
+                await asyncio.sleep(_BACKOFF_BASE * 2 ** attempt)
+            except TelegramAPIError as e:
+                logging.error(f'Failed to send to chat {method.chat_id}: {e}')
+                return None
+        logging.error(f'Gave up sending to chat {method.chat_id} after {_MAX_ATTEMPTS} attempts')
+        return None
+
+    async def broadcast(self, bot: Bot, methods: list[TelegramMethod], name: str = 'broadcast') -> int:
+        """
+        Sends all the requests concurrently and logs delivery latency.
+        Returns the number of delivered requests.
+        """
+        if not methods:
+            return 0
+        start = time.perf_counter()
+        latencies = []
+
+        async def send(method: TelegramMethod) -> bool:
+            delivered = await self.send(bot, method) is not None
+            latencies.append((time.perf_counter() - start) * 1000)
+            return delivered
+
+        delivered = sum(await asyncio.gather(*(send(method) for method in methods)))
+        logging.info(f'{name}: {delivered}/{len(methods)} delivered, '
+                     f'median latency {statistics.median(latencies):.0f} ms, max {max(latencies):.0f} ms')
+        return delivered
+
+
+broadcaster = Broadcaster()
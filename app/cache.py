@@ -0,0 +1,40 @@
+"""
+Module providing a bounded in-memory cache with expiring entries.
+"""
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+import time
+
+
+class TTLCache:
+    """
+    Keeps at most maxsize values for ttl seconds each, the least recently used value is evicted first.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.__maxsize = maxsize
+        self.__ttl = ttl
+        self.__values: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Returns the value or None if there is no value or it has expired.
+        """
+        if key not in self.__values:
+            return None
+        expires, value = self.__values[key]
+        if expires < time.monotonic():
+            del self.__values[key]
+            return None
+        self.__values.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self.__values[key] = (time.monotonic() + self.__ttl, value)
+        self.__values.move_to_end(key)
+        if len(self.__values) > self.__maxsize:
+            self.__values.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.__values)
@@ -1,13 +1,10 @@
 from aiogram import types, F, Router
-from aiogram.types import FSInputFile
+from aiogram.types import BufferedInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.filters import Command, CommandStart, CommandObject
 
-import asyncio
-import os
 import logging
-from typing import Optional, Dict
 
 from . import (
     keyboards, messages,
@@ -120,7 +117,7 @@ async def choose_round_time(
 async def choose_num_of_stones(
     message: types.Message,
     state: FSMContext
-) -> Optional[int]:
+) -> None:
     data = await state.get_data()
     minutes = data['minutes']
     number = 0
@@ -134,7 +131,6 @@ async def choose_num_of_stones(
         lobby = await wr.Lobby.make_lobby(number, minutes*60000)
         await message.answer(messages.lobby_created(lobby.lobby_id()), 
                              reply_markup=keyboards.start_keyboard(True))
-        return lobby.lobby_id()
     else:
         await message.answer(messages.incorrect_num_stones(number))
 
@@ -168,8 +164,7 @@ async def leave_lobby(
 
 @router.message((F.text == 'Начать игру'))
 async def start_game(
-    message: types.Message,
-    queues: Dict[int, asyncio.Queue]
+    message: types.Message
 ) -> None:
     user = await wr.User.add_or_get(message.from_user.id)
     if user.is_admin():
@@ -187,8 +182,7 @@ async def start_game(
             await lobby.start_game()
             await loops.round_loop(
                 bot=message.bot,
-                lobby=lobby,
-                queue=queues[lobby.lobby_id()]
+                lobby=lobby
             )
         except wr.ActionException as ex:
             await message.answer(str(ex))
@@ -196,8 +190,7 @@ async def start_game(
         
 @router.message((F.text == 'Запустить новый раунд'))
 async def start_new_round(
-    message: types.Message,
-    queues: Dict[int, asyncio.Queue]
+    message: types.Message
 ) -> None:
     user = await wr.User.add_or_get(message.from_user.id)
     if user.is_admin():
@@ -211,7 +204,7 @@ async def start_new_round(
                                  reply_markup=keyboards.between_rounds_keyboard(True))
             return
         try:
-            await loops.round_loop(message.bot, lobby, queues[lobby.lobby_id()])
+            await loops.round_loop(message.bot, lobby)
         except wr.ActionException as ex:
             await message.answer(str(ex))
             return
@@ -224,17 +217,16 @@ async def end_game(
     if user.is_admin():
         lobby = await user.lobby()
         users = await lobby.users()
-        logs_path = await lobby.get_logs()
+        logs = await lobby.get_logs()
         await utils.send_document_to_all_users(
             bot=message.bot,
             caption=messages.game_over(True),
             lobby=lobby,
-            document=FSInputFile(logs_path, f'Логи игры {lobby.lobby_id()}.csv'),
+            document=BufferedInputFile(logs, f'Логи игры {lobby.lobby_id()}.csv'),
             reply_markup=keyboards.start_keyboard(True),
             parse_mode='MarkdownV2',
             roles=['admin']
         )
-        os.remove(logs_path)
         await utils.send_message_to_all_users(
             bot=message.bot,
             lobby=lobby,
@@ -249,9 +241,7 @@ async def end_game(
 
 @router.callback_query((F.data.startswith('pick')))
 async def pick_stone(
-    call: types.CallbackQuery,
-    queues: dict[int, asyncio.Queue],
-    picked: dict[int, int]
+    call: types.CallbackQuery
 ) -> None:
     _, stone, round = call.data.split(' ')
     if stone == 'empty':
@@ -271,18 +261,11 @@ async def pick_stone(
                 await user.leave_stone()
             else:
                 await user.choose_stone(stone)
-            picked[lobby.lobby_id()] += 1
-            logging.debug(f"Added to counter: {picked[lobby.lobby_id()]}")
+            logging.debug(f"Decided: {lobby.coordinator().num_decided()}")
         except wr.ActionException as ex:
             logging.debug(f'While user {call.from_user.id} tried pick stone {stone}, error occured: {ex}')
             await call.answer(str(ex))
             return
-        num_players = lobby.number_of_players()
-        if picked[lobby.lobby_id()] == num_players:
-            logging.debug('Everyone made a choice')
-            queue = queues[lobby.lobby_id()]
-            picked[lobby.lobby_id()] = 0
-            await queue.put('chosen')
         await call.answer(messages.choice_is_made())
         await call.message.delete()
 
@@ -394,7 +377,7 @@ async def fire_admin(
             text=messages.fire_notice(),
             reply_markup=keyboards.start_keyboard(False)
         )
-        tg_user = await call.bot.get_chat(id)
+        tg_user = await utils.get_user(call.bot, id)
         name = tg_user.full_name
         admin_ids = await wr.User.get_admins_ids()
         admins = await utils.get_users(call.bot, admin_ids)
@@ -1,22 +1,24 @@
 from aiogram import Bot
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.date import DateTrigger
+from aiogram.methods import SendMessage
 
 import asyncio
 import logging
-from datetime import datetime, timedelta
 
 from . import keyboards, messages
+from .broadcast import broadcaster
+from .timers import timers
 from database import wrappers as wr
 
 
 async def move_loop(
     bot: Bot, 
-    lobby: wr.Lobby,
-    queue: asyncio.Queue
+    lobby: wr.Lobby
 ) -> bool:
     logging.debug('Running new move')
+    # the id is kept: a deleted lobby doesn't return it
+    lobby_id = lobby.lobby_id()
     users = await lobby.users()
+    fields = []
     for user in users:
         if not user.is_admin() and user.status() != 'agent':
             try:
@@ -24,64 +26,110 @@ async def move_loop(
                 logging.debug(f'{user.id} - {info}')
             except wr.ActionException as ex:
                 logging.error(str(ex))
-            await bot.send_message(
+                continue
+            fields.append(SendMessage(
                 chat_id=user.id,
                 text=messages.info_message(),
                 reply_markup=keyboards.field_keyboard(info, lobby.default_stones_cnt, lobby.round())
-            )
+            ))
+    await broadcaster.broadcast(bot, fields, f'Field of lobby {lobby_id}')
     logging.debug('Starting to wait a signal')
-    sig = await queue.get()
-    logging.debug('Sleeping 5 seconds')
-    await asyncio.sleep(5)
+    coordinator = lobby.coordinator()
+    sig = 'reload'
+    while sig == 'reload':
+        timers.schedule(lobby_id, 'move', lobby.move_max_duration_ms / 1000, move_timed_out,
+                        coordinator, coordinator.current_move())
+        try:
+            sig = await coordinator.wait_signal()
+        finally:
+            timers.cancel(lobby_id, 'move')
+    if __game_stopped(lobby):
+        return True
     logging.debug('Ending move')
-    await lobby.end_move()
+    # players who haven't chosen by the time the move ends stand at no stone
+    await lobby.end_move(sig == 'end')
     return sig == 'end'
     
 async def round_loop(
         bot: Bot,
-        lobby: wr.Lobby,
-        queue: asyncio.Queue
+        lobby: wr.Lobby
 ) -> None:
     logging.debug('Starting a new round')
+    lobby_id = lobby.lobby_id()
     await lobby.start_round()
+    # e.g. 'chosen' of a move restored after a restart
+    lobby.coordinator().clear_signals()
     users = await lobby.users()
     minutes = int(lobby.round_duration_ms/60000)
     round = lobby.round()
-    for user in users:
-        if user.status() != 'agent':
-            await bot.send_message(
-                chat_id = user.id,
-                text = messages.round_started(round, minutes, user.is_admin()),
-                parse_mode='MarkdownV2',
-                reply_markup=keyboards.ingame_keyboard(user.is_admin())
-            )
-    logging.debug('Making a scheduler')
-    scheduler = AsyncIOScheduler()
-    scheduler.start()
-    end_time = datetime.now() + timedelta(minutes=minutes)
-    scheduler.add_job(
-        func=round_ended,
-        trigger=DateTrigger(end_time),
-        args=[queue]
-    )
-    is_finished = False
-    while lobby.stones_left() > 0 and not is_finished:
-        logging.debug('Making a new move')
-        is_finished = await move_loop(bot, lobby, queue)
-    while not queue.empty():
-        queue.get_nowait()
+    await broadcaster.broadcast(bot, [
+        SendMessage(
+            chat_id = user.id,
+            text = messages.round_started(round, minutes, user.is_admin()),
+            parse_mode='MarkdownV2',
+            reply_markup=keyboards.ingame_keyboard(user.is_admin())
+        )
+        for user in users if user.status() != 'agent'
+    ], f'Round start in lobby {lobby_id}')
+    timers.schedule(lobby_id, 'round', minutes * 60, round_ended, lobby.coordinator())
+    watcher = asyncio.create_task(__stop_on_game_end(lobby))
+    try:
+        is_finished = False
+        while not is_finished and lobby.stones_left() > 0:
+            logging.debug('Making a new move')
+            is_finished = await move_loop(bot, lobby)
+    finally:
+        # the round may end earlier than its time is up
+        timers.cancel(lobby_id, 'round')
+        watcher.cancel()
+    lobby.coordinator().clear_signals()
+    if __game_stopped(lobby):
+        return
     stones_left = lobby.stones_left()
-    for user in users:
-        if user.status() != 'agent':
-            await bot.send_message(
-                chat_id=user.id,
-                text=messages.round_ended(lobby.round(), stones_left, user.is_admin()),
-                reply_markup=keyboards.between_rounds_keyboard(user.is_admin())
-            )
+    await broadcaster.broadcast(bot, [
+        SendMessage(
+            chat_id=user.id,
+            text=messages.round_ended(lobby.round(), stones_left, user.is_admin()),
+            reply_markup=keyboards.between_rounds_keyboard(user.is_admin())
+        )
+        for user in users if user.status() != 'agent'
+    ], f'Round end in lobby {lobby_id}')
     await lobby.end_round()
 
-async def round_ended(
-    queue: asyncio.Queue
+def __game_stopped(
+    lobby: wr.Lobby
+) -> bool:
+    try:
+        return lobby.status() != 'started'
+    except wr.ActionException:
+        # the lobby has been deleted
+        return True
+
+async def __stop_on_game_end(
+    lobby: wr.Lobby
+) -> None:
+    """
+    Drops the deadlines of the lobby and ends the round once the game is ended or the lobby is deleted.
+    """
+    lobby_id = lobby.lobby_id()
+    try:
+        await lobby.wait_for_status('finished')
+    except wr.ActionException:
+        pass
+    logging.debug(f'Game in lobby {lobby_id} is stopped')
+    timers.cancel_all(lobby_id)
+    lobby.coordinator().signal('end')
+
+def round_ended(
+    coordinator: wr.MoveCoordinator
 ) -> None:
     logging.debug('Time is up. Sending a signal')
-    await queue.put("end")
+    coordinator.signal('end')
+
+def move_timed_out(
+    coordinator: wr.MoveCoordinator,
+    move: int
+) -> None:
+    logging.debug('Move time is up. Sending a signal')
+    # dropped if the move has already ended
+    coordinator.signal('timeout', move)
@@ -1,11 +1,18 @@
 import json
+from functools import cache
 from aiogram.types import User
-from pymorphy3 import MorphAnalyzer
 
 __messages_file = open('data/messages.json', encoding='utf-8')
 Messages = json.load(__messages_file)
 __messages_file.close()
-morph = MorphAnalyzer()
+
+@cache
+def morph():
+    """
+    Returns the morphological analyzer, it loads its dictionaries on the first call.
+    """
+    from pymorphy3 import MorphAnalyzer
+    return MorphAnalyzer()
 
 def info_message():
     return Messages['info_message']
@@ -51,7 +58,7 @@ def lobby_created(n: int):
 
 def lobby_entered(n: int, is_other: bool):
     if is_other:
-        player_word = morph.parse('игрок')[0]
+        player_word = morph().parse('игрок')[0]
         agreed_word = player_word.make_agree_with_number(n).word
         return Messages['lobby_entered_for_others'].format(n, agreed_word)
     else:
@@ -62,7 +69,7 @@ def leaving_lobby_without_being_in():
 
 def left_lobby(left: int, is_other: bool):
     if is_other:
-        player_word = morph.parse('игрок')[0]
+        player_word = morph().parse('игрок')[0]
         agreed_word = player_word.make_agree_with_number(left).word
         return Messages['lobby_left_for_others'].format(left, agreed_word)
     else:
@@ -75,7 +82,7 @@ def not_enough_players_for_start():
     return Messages['not_enough_players_for_start']
 
 def round_started(round: int, minutes: int, isadmin: bool):
-    word = morph.parse('минута')[0].make_agree_with_number(minutes)
+    word = morph().parse('минута')[0].make_agree_with_number(minutes)
     if isadmin:
         return Messages['round_started_for_admin'].format(round, minutes, word.inflect({'gent'}).word)
     else:
@@ -83,7 +90,7 @@ def round_started(round: int, minutes: int, isadmin: bool):
 
 def round_ended(round: int, stones_left: int, is_admin: bool):
     if stones_left > 0:
-        word = morph.parse('камень')[0].make_agree_with_number(stones_left).word
+        word = morph().parse('камень')[0].make_agree_with_number(stones_left).word
         if is_admin:
             return Messages['round_ended_failure_for_admin'].format(round, stones_left, word)
         else:
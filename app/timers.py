@@ -0,0 +1,65 @@
+"""
+Module providing deadlines of lobbies shared by the whole process.
+"""
+from typing import Any, Callable, Optional
+
+import asyncio
+import inspect
+import logging
+
+
+class TimerService:
+    """
+    Deadlines keyed by (lobby_id, kind), e.g. the end of a round, kept in the timer heap of the event loop.
+    A lobby has at most one deadline of each kind: scheduling it again replaces the previous one.
+    """
+
+    def __init__(self):
+        self.__timers: dict[tuple[int, str], asyncio.TimerHandle] = {}
+        self.__tasks: set[asyncio.Task] = set()
+
+    def schedule(self, lobby_id: int, kind: str, delay: float, callback: Callable[..., Any], *args) -> None:
+        """
+        Calls callback(*args) in delay seconds, a coroutine function is run as a task.
+        """
+        self.cancel(lobby_id, kind)
+        loop = asyncio.get_running_loop()
+        self.__timers[(lobby_id, kind)] = loop.call_at(loop.time() + delay, self.__fire, lobby_id, kind, callback, args)
+
+    def __fire(self, lobby_id: int, kind: str, callback: Callable[..., Any], args: tuple) -> None:
+        self.__timers.pop((lobby_id, kind), None)
+        logging.debug(f'Deadline {kind} of lobby {lobby_id} has come')
+        result = callback(*args)
+        if inspect.isawaitable(result):
+            task = asyncio.ensure_future(result)
+            self.__tasks.add(task)
+            task.add_done_callback(self.__tasks.discard)
+
+    def cancel(self, lobby_id: int, kind: str) -> bool:
+        """
+        Cancels the deadline, returns whether it was pending.
+        """
+        timer = self.__timers.pop((lobby_id, kind), None)
+        if timer is None:
+            return False
+        timer.cancel()
+        return True
+
+    def cancel_all(self, lobby_id: int) -> None:
+        """
+        Cancels all the deadlines of the lobby.
+        """
+        for key in [key for key in self.__timers if key[0] == lobby_id]:
+            self.cancel(*key)
+
+    def remaining(self, lobby_id: int, kind: str) -> Optional[float]:
+        """
+        Returns seconds left before the deadline or None if it is not scheduled.
+        """
+        timer = self.__timers.get((lobby_id, kind))
+        if timer is None:
+            return None
+        return max(0.0, timer.when() - asyncio.get_running_loop().time())
+
+
+timers = TimerService()
@@ -1,8 +1,15 @@
 from aiogram import types, Bot
+from aiogram.methods import SendDocument, SendMessage
 
+import asyncio
 from typing import Optional, Union
 
 from database import wrappers as wr
+from .broadcast import broadcaster
+from .cache import TTLCache
+
+# names and usernames of users change rarely, so profiles are kept for a while
+_profiles = TTLCache(maxsize=1024, ttl=600)
 
 async def send_message_to_all_users(
     bot: Bot,
@@ -20,19 +27,20 @@ async def send_message_to_all_users(
     parse_mode: Optional[str] = None
 ) -> None:
     users = await lobby.users()
-    for user in users:
-        if user.status() in roles:
-            await bot.send_message(
-                chat_id=user.id,
-                text=message,
-                parse_mode=parse_mode,
-                reply_markup=reply_markup
-            )
+    await broadcaster.broadcast(bot, [
+        SendMessage(
+            chat_id=user.id,
+            text=message,
+            parse_mode=parse_mode,
+            reply_markup=reply_markup
+        )
+        for user in users if user.status() in roles
+    ], f'Message to lobby {lobby.lobby_id()}')
 
 async def send_document_to_all_users(
     bot: Bot,
     lobby: wr.Lobby,
-    document: Optional[types.InputFile],
+    document: Union[types.InputFile, str],
     caption: Optional[str] = None,
     roles: list[str] = ['player'],
     reply_markup: Optional[
@@ -46,22 +54,42 @@ async def send_document_to_all_users(
     parse_mode: Optional[str] = None
 ) -> None:
     users = await lobby.users()
-    for user in users:
-        if user.status() in roles:
-            await bot.send_document(
-                chat_id=user.id,
-                document=document,
-                caption=caption,
-                parse_mode=parse_mode,
-                reply_markup=reply_markup
-            )
+    requests = [
+        SendDocument(
+            chat_id=user.id,
+            document=document,
+            caption=caption,
+            parse_mode=parse_mode,
+            reply_markup=reply_markup
+        )
+        for user in users if user.status() in roles
+    ]
+    if isinstance(document, types.InputFile):
+        # the file is uploaded once, the others get it by file_id of the uploaded one
+        while requests:
+            sent = await broadcaster.send(bot, requests.pop(0))
+            if sent is not None:
+                for request in requests:
+                    request.document = sent.document.file_id
+                break
+    await broadcaster.broadcast(bot, requests, f'Document to lobby {lobby.lobby_id()}')
 
 async def get_users(
     bot: Bot,
     user_ids: list[int]
-) -> list[types.User]:
-    users = []
-    for id in user_ids:
-        user = await bot.get_chat(id)
-        users.append(user)
-    return users
\ No newline at end of file
+) -> list[types.ChatFullInfo]:
+    """
+    Returns Telegram profiles of the users. Profiles not cached yet are requested concurrently.
+    """
+    users = {id: _profiles.get(id) for id in user_ids}
+    missing = [id for id, user in users.items() if user is None]
+    for id, user in zip(missing, await asyncio.gather(*(bot.get_chat(id) for id in missing))):
+        _profiles.put(id, user)
+        users[id] = user
+    return [users[id] for id in user_ids]
+
+async def get_user(
+    bot: Bot,
+    user_id: int
+) -> types.ChatFullInfo:
+    return (await get_users(bot, [user_id]))[0]
\ No newline at end of file
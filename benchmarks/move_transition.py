@@ -0,0 +1,60 @@
+"""
+Measures how long Lobby.end_move takes depending on the number of players in a lobby.
+
+Needs the same database environment variables as the bot (see docker-compose.yml).
+Creates temporary lobbies and agents and deletes them afterwards.
+
+Usage: python -m benchmarks.move_transition [players ...]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from data.exception import init_exceptions
+from database.query import init_pool, connection_pool
+from database import wrappers as wr
+
+_DEFAULT_PLAYERS = (2, 10, 25, 50, 100)
+_MOVES = 20
+_FIRST_AGENT_ID = -10_000_000
+
+
+async def measure(num_players: int) -> list[float]:
+    """
+    Plays _MOVES moves in a fresh lobby with num_players agents and returns durations of end_move in ms.
+    """
+    lobby = await wr.Lobby.make_lobby(max(num_players, 2), 3_600_000)
+    agents = [await wr.User.add_or_get(_FIRST_AGENT_ID - i, 'agent') for i in range(num_players)]
+    try:
+        for agent in agents:
+            await lobby.join_user(agent)
+        await lobby.start_game()
+        await lobby.start_round()
+        durations = []
+        for _ in range(_MOVES):
+            start = time.perf_counter()
+            await lobby.end_move()
+            durations.append((time.perf_counter() - start) * 1000)
+        await lobby.end_round()
+        await lobby.end_game()
+        return durations
+    finally:
+        await lobby.delete()
+        for agent in agents:
+            await agent.delete()
+
+
+async def main(players: list[int]):
+    init_exceptions()
+    await init_pool()
+    print(f'{"players":>8} {"median, ms":>11} {"p95, ms":>8} {"max, ms":>8}')
+    for num_players in players:
+        durations = sorted(await measure(num_players))
+        p95 = durations[int(0.95 * (len(durations) - 1))]
+        print(f'{num_players:>8} {statistics.median(durations):>11.2f} {p95:>8.2f} {durations[-1]:>8.2f}')
+    await connection_pool.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main([int(arg) for arg in sys.argv[1:]] or list(_DEFAULT_PLAYERS)))
@@ -0,0 +1,77 @@
+"""
+Measures how long a pick takes to be written to the logs depending on the number of moves
+already played in the lobby.
+
+Needs the same database environment variables as the bot (see docker-compose.yml).
+Creates a temporary lobby and agents and deletes them afterwards.
+
+Usage: python -m benchmarks.pick_latency [history_moves ...]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from data.exception import init_exceptions
+from database.query import init_pool, connection_pool
+from database import wrappers as wr
+
+_DEFAULT_HISTORY = (0, 1000, 5000)
+_PLAYERS = 20
+_PICKS = 200
+_FIRST_AGENT_ID = -20_000_000
+
+
+async def measure_picks(lobby: wr.Lobby, agents: list[wr.User]) -> tuple[list[float], list[float]]:
+    """
+    Makes _PICKS picks, every one is written to the logs at once, and ends a move when all the agents
+    have picked. Returns durations of picks and of end_move in ms.
+    """
+    picks, moves = [], []
+    for i in range(_PICKS):
+        agent = agents[i % len(agents)]
+        # every agent stands at its own stone, so no stone is removed
+        stone_id = await lobby.real_to_fake_stone_name(agent.id, i % len(agents) + 1)
+        start = time.perf_counter()
+        await agent.choose_stone(stone_id)
+        await wr.Lobby.flush_logs()
+        picks.append((time.perf_counter() - start) * 1000)
+        if i % len(agents) == len(agents) - 1:
+            start = time.perf_counter()
+            await lobby.end_move()
+            moves.append((time.perf_counter() - start) * 1000)
+    return picks, moves
+
+
+async def main(history: list[int]):
+    init_exceptions()
+    await init_pool()
+    lobby = await wr.Lobby.make_lobby(_PLAYERS, 3_600_000)
+    agents = [await wr.User.add_or_get(_FIRST_AGENT_ID - i, 'agent') for i in range(_PLAYERS)]
+    try:
+        for agent in agents:
+            await lobby.join_user(agent)
+        await lobby.start_game()
+        await lobby.start_round()
+        print(f'{"moves":>8} {"pick median, ms":>16} {"pick p95, ms":>13} {"end_move median, ms":>20}')
+        played = 0
+        for history_moves in sorted(history):
+            while played < history_moves:
+                await lobby.end_move()
+                played += 1
+            picks, moves = await measure_picks(lobby, agents)
+            played += len(moves)
+            picks.sort()
+            print(f'{history_moves:>8} {statistics.median(picks):>16.2f} '
+                  f'{picks[int(0.95 * (len(picks) - 1))]:>13.2f} {statistics.median(moves):>20.2f}')
+        await lobby.end_round()
+        await lobby.end_game()
+    finally:
+        await lobby.delete()
+        for agent in agents:
+            await agent.delete()
+        await connection_pool.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main([int(arg) for arg in sys.argv[1:]] or list(_DEFAULT_HISTORY)))
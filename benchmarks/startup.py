@@ -0,0 +1,57 @@
+"""
+Measures cold-start import time of the bot (main.py) and the API (api.py) with python -X importtime.
+Every run is a fresh interpreter, the median of the runs is reported along with the slowest imports.
+
+Needs the same environment variables as the bot (see docker-compose.yml), modules read them on import.
+
+Usage: python -m benchmarks.startup [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+_DEFAULT_RUNS = 5
+_MODULES = ('main', 'api')
+_TOP_IMPORTS = 10
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the child prints its peak resident memory after the import (in KiB on Linux)
+_SCRIPT = 'import resource, {module}; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)'
+
+
+def import_once(module: str) -> tuple[dict[str, int], int]:
+    """
+    Imports the module in a new interpreter.
+    Returns cumulative import times of all the imported modules in microseconds and peak RSS in KiB.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', _SCRIPT.format(module=module)],
+                            cwd=_ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times, int(result.stdout.split()[-1])
+
+
+def main(runs: int):
+    for module in _MODULES:
+        totals, rss, slowest = [], [], {}
+        for _ in range(runs):
+            times, max_rss = import_once(module)
+            totals.append(times[module] / 1000)
+            rss.append(max_rss / 1024)
+            for name, cumulative in times.items():
+                slowest.setdefault(name, []).append(cumulative / 1000)
+        print(f'{module}: import {statistics.median(totals):.0f} ms, peak RSS {statistics.median(rss):.1f} MiB')
+        # top-level packages only, cumulative times of submodules are included in them
+        top = sorted(((statistics.median(durations), name) for name, durations in slowest.items()
+                      if name != module and '.' not in name), reverse=True)[:_TOP_IMPORTS]
+        for duration, name in top:
+            print(f'  {name:<30} {duration:>8.1f} ms')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else _DEFAULT_RUNS)
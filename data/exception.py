@@ -16,6 +16,12 @@ _LOBBY_FINISHED = "_LOBBY_FINISHED"
 _MAX_POSSIBLE_PLAYERS = "_MAX_POSSIBLE_PLAYERS"
 _ACTION_OUT_OF_LOBBY = "_ACTION_OUT_OF_LOBBY"
 _NO_SUCH_LOBBY = "_NO_SUCH_LOBBY"
+_UNKNOWN_ACTION = "_UNKNOWN_ACTION"
+_MOVE_NOT_ENDED = "_MOVE_NOT_ENDED"
+_MOVE_IS_ENDING = "_MOVE_IS_ENDING"
+_REPEATED_AGENT = "_REPEATED_AGENT"
+_EVENTS_OVERFLOW = "_EVENTS_OVERFLOW"
+_PARQUET_UNAVAILABLE = "_PARQUET_UNAVAILABLE"
 
 
 def init_exceptions():
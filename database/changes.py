@@ -0,0 +1,70 @@
+"""
+Module keeping cached lobbies and users up to date with the changes made by other processes.
+Triggers on public."lobby" and public."user" send every change with NOTIFY (see creating_tables.sql),
+the listener patches the cached objects in place and skips the changes made by this process.
+"""
+import asyncio
+import json
+import logging
+
+import psycopg
+
+from database.query import ORIGIN, dsn, do_request
+from database.wrappers import Lobby, User
+
+CHANNEL = 'stones_changes'
+_RECONNECT_DELAY = 1
+
+
+async def apply_change(change: dict) -> None:
+    """
+    Applies one change from the feed to the cached objects.
+    """
+    if change['origin'] == ORIGIN:
+        return
+    logging.debug(f"{change['operation']} of {change['table']} made by {change['origin'] or 'hand'}: {change['row']}")
+    if change['table'] == 'lobby':
+        await Lobby.apply_change(change['operation'], change['row'])
+    elif change['table'] == 'user':
+        User.apply_change(change['operation'], change['row'])
+
+
+async def refresh_cached() -> None:
+    """
+    Loads again the rows of all the cached objects: changes made while the feed wasn't listened to are unknown.
+    Rows matching the cached state are skipped, so objects of this process are left as they are.
+    """
+    for table, cls, key in (('lobby', Lobby, 'id'), ('user', User, 'tg_id')):
+        ids = cls.cached_ids()
+        if not ids:
+            continue
+        rows = await do_request(f"""SELECT row_to_json(t) FROM public.\"{table}\" AS t WHERE t.{key} = ANY(%s);""",
+                                (ids,))
+        rows = {row[key]: row for row, in rows}
+        for object_id in ids:
+            if object_id in rows:
+                if cls.matches_cache(rows[object_id]):
+                    continue
+                await apply_change({'table': table, 'operation': 'UPDATE', 'origin': None, 'row': rows[object_id]})
+            else:
+                await apply_change({'table': table, 'operation': 'DELETE', 'origin': None, 'row': {key: object_id}})
+
+
+async def listen_changes() -> None:
+    """
+    Listens to the change feed until cancelled, reconnecting when the connection is lost.
+    """
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(dsn, autocommit=True) as conn:
+                await conn.execute(f'LISTEN {CHANNEL};')
+                await refresh_cached()
+                logging.info('Listening to changes of lobbies and users')
+                async for notify in conn.notifies():
+                    try:
+                        await apply_change(json.loads(notify.payload))
+                    except Exception as e:
+                        logging.error(f'Failed to apply change {notify.payload}: {e}')
+        except psycopg.Error as e:
+            logging.error(f'Change feed connection lost: {e}')
+            await asyncio.sleep(_RECONNECT_DELAY)
@@ -15,7 +15,7 @@ CREATE TABLE IF NOT EXISTS public."lobby" (
         round int not null default 0,
         default_stones_cnt int not null default 0,
         current_stones_cnt int not null default 0,
-        move_max_duration_ms int not null default 15,
+        move_max_duration_ms int not null default 15000,
         round_duration_ms int not null default 120
     );
 
@@ -24,4 +24,87 @@ CREATE TABLE IF NOT EXISTS public."user" (
         tg_id bigint unique not null,
         status user_status not null default 'player',
         current_lobby_id int references public."lobby" (id) ON DELETE SET NULL
-    );
\ No newline at end of file
+    );
+
+-- Tables of all the lobbies are shared and keyed by lobby_id, rows are removed together with their lobby.
+CREATE TABLE IF NOT EXISTS public.player_list (
+        id SERIAL primary key,
+        lobby_id int not null references public."lobby" (id) ON DELETE CASCADE,
+        player_id bigint not null,
+        unique (lobby_id, player_id)
+    );
+
+CREATE TABLE IF NOT EXISTS public.stones_list (
+        lobby_id int not null references public."lobby" (id) ON DELETE CASCADE,
+        round_num int not null,
+        move_num int not null,
+        stones varchar(512) not null
+    );
+
+CREATE TABLE IF NOT EXISTS public.player_namings (
+        lobby_id int not null references public."lobby" (id) ON DELETE CASCADE,
+        player_id bigint not null,
+        naming varchar(16) not null,
+        primary key (lobby_id, player_id)
+    );
+
+-- fake is the id under which the player sees the stone real
+CREATE TABLE IF NOT EXISTS public.stones_namings (
+        lobby_id int not null references public."lobby" (id) ON DELETE CASCADE,
+        player_id bigint not null,
+        real int not null,
+        fake int not null,
+        primary key (lobby_id, player_id, real)
+    );
+
+-- logs are the biggest table, so they are split into a fixed number of partitions by lobby
+CREATE TABLE IF NOT EXISTS public.logs (
+        date_time timestamp default current_timestamp,
+        lobby_id int not null references public."lobby" (id) ON DELETE CASCADE,
+        player_id bigint not null,
+        stone_id int,
+        round_number int not null,
+        move_number int not null
+    ) PARTITION BY HASH (lobby_id);
+
+DO $$
+BEGIN
+FOR i IN 0..15 LOOP
+        EXECUTE format('CREATE TABLE IF NOT EXISTS public.logs_%s PARTITION OF public.logs FOR VALUES WITH (MODULUS 16, REMAINDER %s);', i, i);
+    END LOOP;
+END$$;
+
+
+-- logs are looked up by lobby, round, move and player: saving choices, restoring moves, export
+CREATE INDEX IF NOT EXISTS logs_lobby_round_move_player_idx
+    ON public.logs (lobby_id, round_number, move_number, player_id);
+CREATE INDEX IF NOT EXISTS stones_list_lobby_round_move_idx
+    ON public.stones_list (lobby_id, round_num, move_num);
+CREATE INDEX IF NOT EXISTS user_current_lobby_id_idx
+    ON public."user" (current_lobby_id);
+
+-- Changes of lobbies and users are sent to the processes caching them. The payload tells the table,
+-- the operation, the new row (the old one for DELETE) and the process that made the change:
+-- the setting stones.origin of its connections, empty for changes made by hand.
+CREATE OR REPLACE FUNCTION public.notify_change() RETURNS trigger AS $$
+BEGIN
+    -- e.g. the no-op update of User.add_or_get
+    IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN
+        RETURN NULL;
+    END IF;
+    PERFORM pg_notify('stones_changes', json_build_object(
+        'table', TG_TABLE_NAME,
+        'operation', TG_OP,
+        'origin', current_setting('stones.origin', true),
+        'row', row_to_json(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END)
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER lobby_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON public."lobby"
+    FOR EACH ROW EXECUTE FUNCTION public.notify_change();
+CREATE OR REPLACE TRIGGER user_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON public."user"
+    FOR EACH ROW EXECUTE FUNCTION public.notify_change();
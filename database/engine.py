@@ -0,0 +1,326 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional, Sequence
+
+# numpy is imported by the functions using it: it is needed only once a game is running
+# and importing it at module load slows down the start of the bot and the API
+if TYPE_CHECKING:
+    import numpy as np
+
+_NO_STONE = 0
+
+
+class MoveState:
+    """
+    Choices of players during one move, the source of truth while the move lasts.
+    Choices are kept in an array aligned with player_ids, 0 stands for no stone.
+    """
+
+    def __init__(self, round_number: int, move_number: int, player_ids: list[int]):
+        import numpy as np
+
+        self.round_number = round_number
+        self.move_number = move_number
+        self.player_ids = np.array(player_ids, dtype=np.int64)
+        self.__index = {player_id: i for i, player_id in enumerate(player_ids)}
+        self.__choices = np.full(len(player_ids), _NO_STONE, dtype=np.int32)
+
+    def __contains__(self, player_id: int) -> bool:
+        return player_id in self.__index
+
+    def choose(self, player_id: int, stone_id: Optional[int]) -> None:
+        """
+        Sets the choice of the player, None means that the player doesn't stand at any stone.
+        """
+        self.__choices[self.__index[player_id]] = _NO_STONE if stone_id is None else stone_id
+
+    def stone_of(self, player_id: int) -> Optional[int]:
+        """
+        Returns the stone chosen by the player or None.
+        """
+        stone_id = int(self.__choices[self.__index[player_id]])
+        return None if stone_id == _NO_STONE else stone_id
+
+    def choices(self) -> list[tuple[int, Optional[int]]]:
+        """
+        Returns pairs (player_id, stone_id or None) for all the players.
+        """
+        return [(player_id, None if stone_id == _NO_STONE else stone_id)
+                for player_id, stone_id in zip(self.player_ids.tolist(), self.__choices.tolist())]
+
+    def num_chosen(self) -> int:
+        """
+        Returns the number of players standing at some stone.
+        """
+        import numpy as np
+
+        return int(np.count_nonzero(self.__choices))
+
+    def occupancy(self, max_stone: int = 0) -> 'np.ndarray':
+        """
+        Returns numbers of players at every stone: element i is the number of players at stone i,
+        element 0 – the number of players without a stone. The array has at least max_stone + 1 elements.
+        """
+        import numpy as np
+
+        return np.bincount(self.__choices, minlength=max_stone + 1)
+
+    def players_by_stone(self, max_stone: int = 0) -> list['np.ndarray']:
+        """
+        Returns ids of players at every stone (in the order of players), indexed like occupancy().
+        """
+        import numpy as np
+
+        counts = self.occupancy(max_stone)
+        order = np.argsort(self.__choices, kind='stable')
+        return np.split(self.player_ids[order], np.cumsum(counts)[:-1])
+
+    def removed_stones(self, stones: set[int]) -> list[int]:
+        """
+        Returns stones of the given set at which exactly two players stand.
+        """
+        import numpy as np
+
+        if not stones:
+            return []
+        stones = np.fromiter(stones, dtype=np.int64, count=len(stones))
+        counts = self.occupancy(int(stones.max()))
+        return sorted(stones[counts[stones] == 2].tolist())
+
+
+class MoveCoordinator:
+    """
+    Decides when a move of one lobby ends. Keeps a bitmap of players who have made a decision
+    in the current move (leaving stones is a decision too) and a queue of signals for the move loop:
+    'chosen' when everyone has decided, 'timeout' when the move time is up, 'end' when the round time is up,
+    'reload' when the move has been loaded again from the database and its deadline has to be set anew.
+    Deciding again doesn't count twice, so the move is complete exactly when the counter reaches
+    the number of players.
+
+    Every move gets its own number: 'chosen', 'timeout' and 'reload' carry the number of their move and
+    are dropped once the move is over, 'end' concerns the whole round.
+    """
+
+    def __init__(self):
+        # a bytearray rather than a numpy array: every lobby has a coordinator, numpy is needed only in games
+        self.__index: dict[int, int] = {}
+        self.__decided = bytearray()
+        self.__num_decided = 0
+        self.__move = 0
+        self.__closed = True
+        self.__signals: asyncio.Queue[tuple[Optional[int], str]] = asyncio.Queue()
+
+    def start_move(self, player_ids: list[int]) -> None:
+        """
+        Starts a new move in which nobody has decided yet and drops the signals of the previous moves.
+        """
+        self.__index = {player_id: i for i, player_id in enumerate(player_ids)}
+        self.__decided = bytearray(len(player_ids))
+        self.__num_decided = 0
+        self.__move += 1
+        self.__closed = False
+        round_signals = []
+        while not self.__signals.empty():
+            move, sig = self.__signals.get_nowait()
+            if move is None:
+                round_signals.append((move, sig))
+        for item in round_signals:
+            self.__signals.put_nowait(item)
+
+    def current_move(self) -> int:
+        """
+        Returns the number of the current move, it identifies the move among all the moves of the lobby.
+        """
+        return self.__move
+
+    def close_move(self) -> None:
+        """
+        Marks that the current move is being resolved: decisions are ignored until the next move starts.
+        """
+        self.__closed = True
+
+    def reopen_move(self) -> None:
+        """
+        Accepts decisions of the current move again after its resolution has failed.
+        """
+        self.__closed = False
+
+    def is_closed(self) -> bool:
+        return self.__closed
+
+    def decide(self, player_id: int) -> bool:
+        """
+        Marks that the player has made a decision in the current move. Sends 'chosen' and
+        returns True if the player was the last one to decide. Raises KeyError for an unknown player.
+        """
+        i = self.__index[player_id]
+        if self.__closed or self.__decided[i]:
+            return False
+        self.__decided[i] = 1
+        self.__num_decided += 1
+        if self.__num_decided == len(self.__decided):
+            self.signal('chosen', self.__move)
+            return True
+        return False
+
+    def has_decided(self, player_id: int) -> bool:
+        return bool(self.__decided[self.__index[player_id]])
+
+    def num_decided(self) -> int:
+        return self.__num_decided
+
+    def signal(self, sig: str, move: Optional[int] = None) -> None:
+        """
+        Sends a signal to the move loop.
+        :param move: the number of the move the signal concerns (see current_move), None for the whole round
+        """
+        self.__signals.put_nowait((move, sig))
+
+    def has_signal(self) -> bool:
+        """
+        Returns True if there is a signal the move loop hasn't received yet.
+        """
+        return not self.__signals.empty()
+
+    async def wait_signal(self) -> str:
+        """
+        Waits for the next signal concerning the current move.
+        """
+        while True:
+            move, sig = await self.__signals.get()
+            if move is None or move == self.__move:
+                return sig
+            logging.debug(f'Dropped signal {sig} of move {move}')
+
+    def clear_signals(self) -> None:
+        """
+        Drops signals left after the end of a round.
+        """
+        while not self.__signals.empty():
+            self.__signals.get_nowait()
+
+
+class StoneNamings:
+    """
+    Permutations of stone ids: every player sees real stone i under its own fake id.
+    Both directions are kept as rows of lookup tables, so a translation is one indexing
+    and a whole array of stones is translated with one gather. Stone 0 (no stone) is 0 for everyone.
+    """
+
+    def __init__(self, namings: dict[int, Sequence[int]]):
+        """
+        :param namings: player id -> fake ids of real stones 1, 2, ...
+        """
+        import numpy as np
+
+        self.__index = {player_id: i for i, player_id in enumerate(namings)}
+        self.__stones_cnt = len(next(iter(namings.values()), ()))
+        self.__to_fake = np.zeros((len(namings), self.__stones_cnt + 1), dtype=np.int32)
+        for i, naming in enumerate(namings.values()):
+            self.__to_fake[i, 1:] = naming
+        self.__to_real = np.zeros_like(self.__to_fake)
+        rows = np.arange(len(namings))[:, np.newaxis]
+        self.__to_real[rows, self.__to_fake] = np.arange(self.__stones_cnt + 1)
+
+    def __contains__(self, player_id: int) -> bool:
+        return player_id in self.__index
+
+    def __stones(self, stone_ids):
+        import numpy as np
+
+        stone_ids = np.asarray(stone_ids, dtype=np.int64)
+        if stone_ids.size and (stone_ids.min() < 0 or stone_ids.max() > self.__stones_cnt):
+            raise KeyError(stone_ids)
+        return stone_ids
+
+    def __row(self, player_id: int, stone_ids):
+        return self.__index[player_id], self.__stones(stone_ids)
+
+    def to_fake(self, player_id: int, stone_ids):
+        """
+        Translates a real stone id (or an array of them) to the fake ones seen by the player.
+        Raises KeyError for an unknown player or stone.
+        """
+        row, stone_ids = self.__row(player_id, stone_ids)
+        result = self.__to_fake[row, stone_ids]
+        return int(result) if result.ndim == 0 else result
+
+    def to_fake_many(self, player_ids: Sequence[int], stone_ids) -> 'np.ndarray':
+        """
+        Translates real stone ids for many players with one gather: row i holds the fake ids seen by player_ids[i].
+        Raises KeyError for an unknown player or stone.
+        """
+        import numpy as np
+
+        rows = np.fromiter((self.__index[player_id] for player_id in player_ids), dtype=np.int64,
+                           count=len(player_ids))
+        return self.__to_fake[rows[:, np.newaxis], self.__stones(stone_ids)[np.newaxis, :]]
+
+    def to_real(self, player_id: int, stone_ids):
+        """
+        Translates a fake stone id seen by the player (or an array of them) to the real ones.
+        Raises KeyError for an unknown player or stone.
+        """
+        row, stone_ids = self.__row(player_id, stone_ids)
+        result = self.__to_real[row, stone_ids]
+        return int(result) if result.ndim == 0 else result
+
+
+class LogWriter:
+    """
+    Write-behind persistence of choices. Keeps the last choice of every player of the current
+    move and writes them all with one call of flush_func, at most delay seconds after the first
+    unsaved choice or when flush() is awaited.
+    """
+
+    def __init__(self, flush_func: Callable[[int, int, list[tuple[int, Optional[int]]]], Awaitable[None]],
+                 delay: float):
+        self.__flush_func = flush_func
+        self.__delay = delay
+        self.__pending: dict[tuple[int, int], dict[int, Optional[int]]] = {}
+        self.__lock = asyncio.Lock()
+        self.__timer: Optional[asyncio.TimerHandle] = None
+        self.__tasks: set[asyncio.Task] = set()
+
+    def add(self, round_number: int, move_number: int, player_id: int, stone_id: Optional[int]) -> None:
+        """
+        Remembers the choice and schedules a flush.
+        """
+        self.__pending.setdefault((round_number, move_number), {})[player_id] = stone_id
+        if self.__timer is None:
+            self.__timer = asyncio.get_running_loop().call_later(self.__delay, self.__flush_in_background)
+
+    def __flush_in_background(self) -> None:
+        self.__timer = None
+        task = asyncio.create_task(self.__background_flush())
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def __background_flush(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            # already logged by flush, the choices are kept, so try again later
+            if self.__timer is None:
+                self.__timer = asyncio.get_running_loop().call_later(self.__delay, self.__flush_in_background)
+
+    async def flush(self) -> None:
+        """
+        Writes all the unsaved choices. Choices that failed to be written are kept for the next flush
+        unless they have been overwritten since.
+        """
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        async with self.__lock:
+            pending, self.__pending = self.__pending, {}
+            for key in list(pending):
+                round_number, move_number = key
+                try:
+                    await self.__flush_func(round_number, move_number, list(pending[key].items()))
+                except Exception as e:
+                    logging.error(f'Failed to save choices of round {round_number} move {move_number}: {e}')
+                    for failed_key, choices in pending.items():
+                        self.__pending[failed_key] = choices | self.__pending.get(failed_key, {})
+                    raise
+                del pending[key]
@@ -0,0 +1,35 @@
+-- Moves the data of per-lobby schemas lobby_N into the shared tables keyed by lobby_id and drops the schemas.
+-- Apply creating_tables.sql first, it creates the shared tables:
+--   psql -f database/creating_tables/creating_tables.sql -f database/migrations/001_shared_lobby_tables.sql
+DO $$
+DECLARE
+    lobby_schema text;
+    lobby_number int;
+BEGIN
+FOR lobby_schema, lobby_number IN
+        SELECT nspname, substring(nspname FROM 7)::int FROM pg_namespace WHERE nspname ~ '^lobby_[0-9]+$'
+    LOOP
+    IF EXISTS (SELECT 1 FROM public."lobby" WHERE id = lobby_number) THEN
+        EXECUTE format('INSERT INTO public.player_list (lobby_id, player_id)
+                        SELECT %s, player_id FROM %I.player_list ORDER BY id;', lobby_number, lobby_schema);
+        EXECUTE format('INSERT INTO public.stones_list (lobby_id, round_num, move_num, stones)
+                        SELECT %s, round_num, move_num, stones FROM %I.stones_list;', lobby_number, lobby_schema);
+        EXECUTE format('INSERT INTO public.logs (date_time, lobby_id, player_id, stone_id, round_number, move_number)
+                        SELECT date_time, %s, player_id, stone_id, round_number, move_number FROM %I.logs;',
+                       lobby_number, lobby_schema);
+        -- namings tables appear only after the game has been started
+        IF to_regclass(format('%I.player_namings', lobby_schema)) IS NOT NULL THEN
+            EXECUTE format('INSERT INTO public.player_namings (lobby_id, player_id, naming)
+                            SELECT %s, player_id, naming FROM %I.player_namings;', lobby_number, lobby_schema);
+        END IF;
+        -- stones_namings had a column per real stone holding its fake id, they become rows
+        IF to_regclass(format('%I.stones_namings', lobby_schema)) IS NOT NULL THEN
+            EXECUTE format('INSERT INTO public.stones_namings (lobby_id, player_id, real, fake)
+                            SELECT %s, namings.player_id, stones.key::int, stones.value::int
+                            FROM %I.stones_namings AS namings,
+                                 jsonb_each_text(to_jsonb(namings) - ''player_id'') AS stones;', lobby_number, lobby_schema);
+        END IF;
+    END IF;
+    EXECUTE format('DROP SCHEMA %I CASCADE;', lobby_schema);
+END LOOP;
+END$$;
@@ -0,0 +1,3 @@
+-- Lobby ids used to be chosen by the bot and inserted explicitly, so the sequence of the SERIAL column
+-- was never advanced. Moves it past the existing ids, new lobbies take their ids from it.
+SELECT setval(pg_get_serial_sequence('public.lobby', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM public."lobby";
@@ -0,0 +1,8 @@
+-- Indexes for lookups of logs and stones by lobby, round and move, and of users by their lobby.
+-- An index on the partitioned logs table is created on every partition.
+CREATE INDEX IF NOT EXISTS logs_lobby_round_move_player_idx
+    ON public.logs (lobby_id, round_number, move_number, player_id);
+CREATE INDEX IF NOT EXISTS stones_list_lobby_round_move_idx
+    ON public.stones_list (lobby_id, round_num, move_num);
+CREATE INDEX IF NOT EXISTS user_current_lobby_id_idx
+    ON public."user" (current_lobby_id);
@@ -0,0 +1,4 @@
+-- move_max_duration_ms used to be stored in seconds (the default was 15) but was never enforced.
+-- Now a move ends when it expires, so the values are converted to milliseconds.
+ALTER TABLE public."lobby" ALTER COLUMN move_max_duration_ms SET DEFAULT 15000;
+UPDATE public."lobby" SET move_max_duration_ms = move_max_duration_ms * 1000 WHERE move_max_duration_ms < 1000;
@@ -0,0 +1,25 @@
+-- Changes of lobbies and users are sent to the processes caching them. The payload tells the table,
+-- the operation, the new row (the old one for DELETE) and the process that made the change:
+-- the setting stones.origin of its connections, empty for changes made by hand.
+CREATE OR REPLACE FUNCTION public.notify_change() RETURNS trigger AS $$
+BEGIN
+    -- e.g. the no-op update of User.add_or_get
+    IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN
+        RETURN NULL;
+    END IF;
+    PERFORM pg_notify('stones_changes', json_build_object(
+        'table', TG_TABLE_NAME,
+        'operation', TG_OP,
+        'origin', current_setting('stones.origin', true),
+        'row', row_to_json(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END)
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER lobby_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON public."lobby"
+    FOR EACH ROW EXECUTE FUNCTION public.notify_change();
+CREATE OR REPLACE TRIGGER user_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON public."user"
+    FOR EACH ROW EXECUTE FUNCTION public.notify_change();
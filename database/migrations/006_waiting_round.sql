@@ -0,0 +1,7 @@
+-- end_round used to store the number of the next round in a waiting lobby while the process kept
+-- the number of the played one, so a lobby loaded from the database skipped a round.
+-- Waiting lobbies get back the number of their last played round.
+UPDATE public."lobby" AS lobby SET round = lobby.round - 1
+WHERE lobby.status = 'waiting' AND lobby.round > 0
+  AND NOT EXISTS (SELECT 1 FROM public.stones_list AS stones
+                  WHERE stones.lobby_id = lobby.id AND stones.round_num = lobby.round);
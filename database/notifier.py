@@ -0,0 +1,76 @@
+import asyncio
+from typing import Any, Optional
+
+
+class Notifier:
+    """
+    One-shot broadcast signal that re-arms itself after every notification.
+
+    All coroutines awaiting the current waiter are woken at once with the value passed
+    to notify(), after that the next call to waiter() returns a fresh future.
+    """
+
+    def __init__(self):
+        self.__future: Optional[asyncio.Future] = None
+
+    def waiter(self) -> asyncio.Future:
+        """
+        Returns the future that will be resolved by the next notification.
+        Take it before starting an action whose completion should be awaited,
+        so that a notification fired in between is not missed.
+        """
+        if self.__future is None or self.__future.done():
+            self.__future = asyncio.get_running_loop().create_future()
+        return self.__future
+
+    def notify(self, value: Any = None) -> None:
+        """
+        Wakes all the waiters with the given value.
+        """
+        future, self.__future = self.__future, None
+        if future is not None and not future.done():
+            future.set_result(value)
+
+    async def wait(self, timeout: Optional[float] = None, waiter: Optional[asyncio.Future] = None) -> Any:
+        """
+        Waits for the next notification and returns its value.
+        Raises asyncio.TimeoutError if timeout (in seconds) expires.
+        """
+        if waiter is None:
+            waiter = self.waiter()
+        # shield: a timed out waiter must not cancel the future shared with other waiters
+        return await asyncio.wait_for(asyncio.shield(waiter), timeout)
+
+
+class EventBus:
+    """
+    Delivers every published event to all the subscribers. Every subscriber has its own bounded queue,
+    so a slow subscriber doesn't delay the others and misses nothing published after subscribing.
+    A subscriber whose queue is full is dropped: its queue is emptied and gets only OVERFLOW.
+    """
+    OVERFLOW = {'type': 'overflow'}
+
+    def __init__(self, maxsize: int = 100):
+        self.__maxsize = maxsize
+        self.__subscribers: set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Returns a queue receiving all the events published from now on. Unsubscribe it when done.
+        """
+        queue = asyncio.Queue(self.__maxsize)
+        self.__subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self.__subscribers.discard(queue)
+
+    def publish(self, event: dict) -> None:
+        for queue in list(self.__subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.__subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(EventBus.OVERFLOW)
@@ -1,10 +1,12 @@
 import asyncio
 import logging
 import os
+import uuid
 from typing import Optional
 
 import psycopg
 import psycopg_pool
+from psycopg.abc import Params, Query
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,10 +19,25 @@ dsn = "dbname=%s user=%s password=%s host=%s port=%s" % (
     os.getenv("POSTGRES_PORT"),
 )
 
+# number of executions after which psycopg prepares a query on the server side,
+# queries executed with prepare=True are prepared right away
+PREPARE_THRESHOLD = int(os.getenv("POSTGRES_PREPARE_THRESHOLD", 2))
+
+# tags changes made by this process in the change feed (see database/changes.py), so that it skips them
+ORIGIN = uuid.uuid4().hex
+
+
+async def configure_connection(conn: psycopg.AsyncConnection) -> None:
+    await conn.execute("SELECT set_config('stones.origin', %s, false);", (ORIGIN,))
+    await conn.commit()
+
+
 connection_pool = psycopg_pool.AsyncConnectionPool(
         conninfo=dsn,
         min_size=os.cpu_count(),
         max_size=max(int(os.getenv("POSTGRES_MAX_CONNECTIONS")) - 10, os.cpu_count()),
+        kwargs={"prepare_threshold": PREPARE_THRESHOLD},
+        configure=configure_connection,
         open=False,
     )
 
@@ -30,11 +47,16 @@ async def init_pool():
     logging.info("Connection pool initialized")
 
 
-async def do_request(request: str) -> Optional[list]:
+async def do_request(request: Query, params: Optional[Params] = None, prepare: Optional[bool] = None) -> Optional[list]:
+    """
+    Executes a query with bound parameters and returns its rows (None if the query returns nothing).
+    :param prepare: True to prepare the query on the server at once, False to never prepare it,
+                    None to leave it to the PREPARE_THRESHOLD of the connection
+    """
     async with connection_pool.connection() as conn:
         cursor = conn.cursor()
         try:
-            await cursor.execute(request)
+            await cursor.execute(request, params, prepare=prepare)
             result = await cursor.fetchall()
         except psycopg.ProgrammingError as e:
             if str(e) == "the last operation didn't produce a result":
@@ -1,19 +1,20 @@
+import asyncio
 import datetime
+import io
 import string
+import zlib
 from collections import deque
 
-import numpy as np
-import pandas as pd
 import logging
-import os
-import time
-from typing import Optional
+from typing import BinaryIO, Optional
 
 from psycopg import DatabaseError
 
 from data.exception import ActionException, _NO_SUCH_ELEMENT, _DATA_DELETED, _NOT_SYNCHRONIZED_WITH_DATABASE, \
     _GAME_IS_RUNNING, _ALREADY_IN_LOBBY, _NOT_IN_LOBBY, _GAME_IS_NOT_RUNNING, _ALREADY_CHOSEN_STONE, init_exceptions, \
-    _NO_SUCH_STONE, _MAX_POSSIBLE_PLAYERS, _LOBBY_FINISHED
+    _NO_SUCH_STONE, _MAX_POSSIBLE_PLAYERS, _LOBBY_FINISHED, _MOVE_IS_ENDING, _PARQUET_UNAVAILABLE
+from database.engine import LogWriter, MoveCoordinator, MoveState, StoneNamings
+from database.notifier import EventBus, Notifier
 from database.query import connection_pool, do_request
 
 
@@ -22,6 +23,8 @@ def gen_rnd_matrix(lines: int, columns: int = None) -> tuple[tuple[int, ...], ..
     """
     Generates matrix of ids for players in lobby.
     """
+    import numpy as np
+
     if columns is None:
         columns = lines
     order = list(range(1, columns + 1))
@@ -34,7 +37,14 @@ def gen_rnd_matrix(lines: int, columns: int = None) -> tuple[tuple[int, ...], ..
 
 _START_ROUND_VALUE = 0
 _DEFAULT_ROUND_DURATION = 120
-_DEFAULT_MOVE_DURATION = 15
+_DEFAULT_MOVE_DURATION = 15000
+# how long choices of players may stay only in memory before they are written to the logs, in seconds
+_LOG_FLUSH_DELAY = 1.0
+# formats of the logs export, file extensions as well
+LOG_FORMATS = ('csv', 'csv.gz', 'parquet')
+_LOG_COLUMNS = ('date_time', 'player_id', 'stone_id', 'round_number', 'move_number')
+# rows fetched from the server at once when the logs are exported to parquet
+_EXPORT_BATCH_SIZE = 10_000
 
 
 def player_naming_generator():
@@ -63,7 +73,7 @@ class Lobby:
     """
     __instances: dict[int, 'Lobby'] = {}
 
-    def __init__(self, lobby_id: int, stones_set: dict[int, set] = None, stones_namings: dict[int, list[int]] = None,
+    def __init__(self, lobby_id: int, stones_set: dict[int, set] = None, stones_namings: Optional[StoneNamings] = None,
                  move_max_duration_ms: int = _DEFAULT_MOVE_DURATION,
                  round_duration_ms: int = _DEFAULT_ROUND_DURATION, default_stones_cnt: int = 1, current_stones: int = 1, num_players: int = 0,
                  status: str = 'created',
@@ -81,9 +91,23 @@ class Lobby:
         self.__round_duration_ms = round_duration_ms
         self.__stones_namings = stones_namings
         self.__stones_set = stones_set if stones_set is not None else {1: set(range(1, default_stones_cnt + 1))}
+        self.__members: Optional[dict[int, 'User']] = None
+        # choices of the current move and of the previous one (shown on the field)
+        self.__move: Optional[MoveState] = None
+        self.__last_move: Optional[MoveState] = None
+        # fake names of players (loaded lazily) and the field of the shown move built from them
+        self.__player_namings: Optional[dict[int, str]] = None
+        self.__field_snapshot: Optional[dict[int, list[tuple[int, str]]]] = None
+        self.__log_writer = LogWriter(self.__save_choices, _LOG_FLUSH_DELAY)
+        # decisions of players in the current move and signals ending it, shared by the bot and the API
+        self.__coordinator = MoveCoordinator()
+        self.__move_notifier = Notifier()
+        self.__state_notifier = Notifier()
+        # events of the game for the streams of agents
+        self.__events = EventBus()
 
     def __new__(cls, lobby_id: int, stones_set: dict[int, set] = None,
-                stones_namings: dict[int, list[int]] = None, move_max_duration_ms: int = _DEFAULT_MOVE_DURATION,
+                stones_namings: Optional[StoneNamings] = None, move_max_duration_ms: int = _DEFAULT_MOVE_DURATION,
                 round_duration_ms: int = _DEFAULT_ROUND_DURATION, default_stones_cnt: int = 1, current_stones: int = 1, num_players: int = 0,
                 status: str = 'created',
                 round_num: int = _START_ROUND_VALUE,
@@ -102,27 +126,122 @@ class Lobby:
         if lobby_id in cls.__instances:
             return cls.__instances[lobby_id]
         db_lobby = await do_request(
-            f"SELECT move_max_duration_ms, round_duration_ms, default_stones_cnt, current_stones_cnt, num_players, status, round "
-            f"FROM public.\"lobby\" WHERE id = {lobby_id}")
+            "SELECT move_max_duration_ms, round_duration_ms, default_stones_cnt, current_stones_cnt, num_players, status, round "
+            "FROM public.\"lobby\" WHERE id = %s", (lobby_id,))
         if db_lobby:
-            stones_set = await do_request("""
-                                            SELECT move_num, stones from lobby_%s.\"stones_list\" WHERE round_num=%s;
-                                        """ % (lobby_id, db_lobby[0][-1]))
-            stones_set = {round_stones[0]: set(list(map(int, round_stones[1].split(',')))) for round_stones in
-                          stones_set}
-            if db_lobby[0][-2] != 'created':
-                stones_namings = await do_request("""
-                SELECT * FROM lobby_%s.\"stones_namings\";
-                """ % (lobby_id,))
-                stones_namings = {int(naming[0]): naming[1:] for naming in stones_namings}
-            else:
-                stones_namings = None
+            stones_set = await cls.__fetch_stones_set(lobby_id, db_lobby[0][-1])
+            stones_namings = await cls.__fetch_stones_namings(lobby_id) if db_lobby[0][-2] != 'created' else None
 
-            instance = cls(lobby_id, stones_set, stones_namings, *db_lobby[0])
+            # stones_list has a row for every move of the round, the last one is the current move
+            instance = cls(lobby_id, stones_set, stones_namings, *db_lobby[0],
+                           move_number=max(stones_set, default=0))
             instance.__database_consistent = True
+            if instance.__status == 'started':
+                await instance.__restore_moves()
             return instance
         raise ActionException(_NO_SUCH_ELEMENT)
 
+    @staticmethod
+    async def __fetch_stones_set(lobby_id: int, round_num: int) -> dict[int, set]:
+        """
+        Returns stones left at every move of the round.
+        """
+        stones_set = await do_request("""
+                                        SELECT move_num, stones FROM public.stones_list WHERE lobby_id = %s AND round_num = %s;
+                                    """, (lobby_id, round_num))
+        return {round_stones[0]: set(list(map(int, round_stones[1].split(',')))) for round_stones in stones_set}
+
+    @staticmethod
+    async def __fetch_stones_namings(lobby_id: int) -> StoneNamings:
+        stones_namings = await do_request("""
+        SELECT player_id, array_agg(fake ORDER BY real) FROM public.stones_namings
+        WHERE lobby_id = %s
+        GROUP BY player_id;
+        """, (lobby_id,))
+        return StoneNamings({int(naming[0]): naming[1] for naming in stones_namings})
+
+    @classmethod
+    def cached_ids(cls) -> list[int]:
+        """
+        Returns ids of the lobbies kept in memory.
+        """
+        return list(cls.__instances)
+
+    @classmethod
+    async def apply_change(cls, operation: str, row: dict) -> None:
+        """
+        Applies a change of a row of public."lobby" made by another process (or by hand) to the cached lobby.
+        When a round or the status has changed, the state of the round is loaded again.
+        :param operation: INSERT, UPDATE or DELETE
+        :param row: the row after the change (before it for DELETE)
+        """
+        self = cls.__instances.get(row['id'])
+        if self is None:
+            return
+        if operation == 'DELETE':
+            self.__release_move_waiters()
+            self.__deleted = True
+            cls.__instances.pop(row['id'], None)
+            self.__state_notifier.notify(None)
+            self.__events.publish({'type': 'game_ended'})
+            return
+        round_changed = row['round'] != self.__round or row['status'] != self.__status
+        self.__num_players = row['num_players']
+        self.__default_stones_cnt = row['default_stones_cnt']
+        self.__move_max_duration_ms = row['move_max_duration_ms']
+        self.__round_duration_ms = row['round_duration_ms']
+        self.__members = None
+        if round_changed:
+            # the move they wait for is replaced by the one loaded from the database
+            self.__release_move_waiters()
+            self.__round = row['round']
+            self.__status = row['status']
+            # during a round the count in the row is updated only when the round ends
+            self.__current_stones_cnt = row['current_stones_cnt']
+            await self.__reload_round()
+            if self.__status == 'started':
+                # the restored move has a new number, a running move loop has to set its deadline again
+                self.__coordinator.signal('reload', self.__coordinator.current_move())
+            self.__state_notifier.notify(self.__status)
+            if self.__status == 'finished':
+                self.__events.publish({'type': 'game_ended'})
+
+    @classmethod
+    def matches_cache(cls, row: dict) -> bool:
+        """
+        Returns True if the row of public."lobby" holds nothing new for the cached lobby (or it isn't cached).
+        """
+        self = cls.__instances.get(row['id'])
+        if self is None:
+            return True
+        return (row['round'], row['status'], row['num_players'], row['default_stones_cnt'],
+                row['move_max_duration_ms'], row['round_duration_ms']) == \
+            (self.__round, self.__status, self.__num_players, self.__default_stones_cnt,
+             self.__move_max_duration_ms, self.__round_duration_ms)
+
+    @classmethod
+    def forget_members(cls, lobby_id: int) -> None:
+        """
+        Makes the cached lobby load its members again, e.g. after a user has entered it in another process.
+        """
+        if lobby_id in cls.__instances:
+            cls.__instances[lobby_id].__members = None
+
+    async def __reload_round(self):
+        """
+        Loads the state of the current round as get_lobby does.
+        """
+        self.__stones_set = await Lobby.__fetch_stones_set(self.__lobby_id, self.__round)
+        self.__move_number = max(self.__stones_set, default=0)
+        self.__stones_namings = await Lobby.__fetch_stones_namings(self.__lobby_id) \
+            if self.__status != 'created' else None
+        self.__player_namings = None
+        self.__move = None
+        self.__last_move = None
+        self.__field_snapshot = None
+        if self.__status == 'started':
+            await self.__restore_moves()
+
     @classmethod
     async def make_lobby(cls, stones: int, round_duration_ms: int = _DEFAULT_ROUND_DURATION,
                          move_max_duration_ms: int = _DEFAULT_MOVE_DURATION):
@@ -133,54 +252,12 @@ class Lobby:
             try:
                 cursor = conn.cursor()
 
+                # the id is taken from the sequence of the SERIAL column, so concurrent creations never collide
                 await cursor.execute(
-                    """SELECT id FROM public.\"lobby\";""")
+                    """INSERT INTO public.\"lobby\" (num_players, status, round, default_stones_cnt, current_stones_cnt, move_max_duration_ms, round_duration_ms) 
+                    VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id;""",
+                    (0, 'created', _START_ROUND_VALUE, stones, stones, move_max_duration_ms, round_duration_ms))
                 result = await cursor.fetchall()
-                result = [row[0] for row in result]
-                if not result:
-                    next_id = 1
-                elif list(range(1, max(result) + 1)) == sorted(result):
-                    next_id = max(result) + 1
-                else:
-                    for i in range(1, max(result) + 1):
-                        if i not in result:
-                            next_id = i
-                            break
-
-                await cursor.execute(
-                    """INSERT INTO public.\"lobby\" (id, num_players, status, round, default_stones_cnt, current_stones_cnt, move_max_duration_ms, round_duration_ms) 
-                    VALUES (%s, %s, \'%s\', %s, %s, %s, %s, %s) RETURNING *;""" %
-                    (next_id, 0, 'created', _START_ROUND_VALUE, stones, stones, move_max_duration_ms, round_duration_ms))
-                result = await cursor.fetchall()
-
-                await cursor.execute(
-                    """CREATE SCHEMA lobby_%s;""" %
-                    (result[0][0]))
-                await cursor.execute(
-                    """CREATE TABLE lobby_%s.\"logs\"
-                    (
-                        date_time timestamp default current_timestamp,
-                        player_id bigint not null,
-                        stone_id int,
-                        round_number int not null,
-                        move_number int not null
-                    );""" %
-                    (result[0][0]))
-                await cursor.execute(
-                    """CREATE TABLE lobby_%s.\"player_list\"
-                    (
-                        id SERIAL primary key,
-                        player_id bigint not null unique
-                    );""" %
-                    (result[0][0]))
-                await cursor.execute(
-                    """CREATE TABLE lobby_%s.\"stones_list\"
-                    (
-                        round_num int not null,
-                        move_num int not null,
-                        stones varchar(512) not null
-                    );""" %
-                    (result[0][0]))
             except DatabaseError as e:
                 await conn.rollback()
                 raise ActionException(e.sqlstate) from e
@@ -196,25 +273,108 @@ class Lobby:
         self.__database_consistent = True
         return self
 
+    @classmethod
+    async def flush_logs(cls):
+        """
+        Writes choices of players not yet saved in all the lobbies, e.g. before shutdown.
+        """
+        for lobby in list(cls.__instances.values()):
+            await lobby.__log_writer.flush()
+
     @staticmethod
     async def lobby_ids(is_for_admin: bool = False):
         """
         Returns list of ids of all lobbies in the database
         """
         if is_for_admin:
-            db_lobbies = await do_request(f"SELECT id FROM public.\"lobby\" where status NOT IN ('finished');")
+            db_lobbies = await do_request("SELECT id FROM public.\"lobby\" where status NOT IN ('finished');")
         else:
-            db_lobbies = await do_request(f"SELECT id FROM public.\"lobby\" where status IN ('created');")
+            db_lobbies = await do_request("SELECT id FROM public.\"lobby\" where status IN ('created');")
         return [lobbies[0] for lobbies in db_lobbies]
 
     async def num_players_with_chosen_stone(self):
         """
         Returns number of players with chosen stone
         """
-        db_num_players = await do_request(
-            """SELECT count(1) FROM lobby_%s.\"logs\" WHERE stone_id is not null and round_number = %s and move_number = %s;"""
-            % (self.__lobby_id, self.__round, self.__move_number))
-        return db_num_players[0][0]
+        if self.__move is None:
+            return 0
+        return self.__move.num_chosen()
+
+    async def __restore_moves(self):
+        """
+        Restores choices of the current and the previous move from the logs.
+        """
+        result = await do_request("""
+        SELECT move_number, player_id, stone_id FROM public.logs
+        WHERE lobby_id = %s AND round_number = %s AND move_number IN (%s, %s)
+        ORDER BY player_id;""",
+                                  (self.__lobby_id, self.__round, self.__move_number - 1, self.__move_number))
+        moves = {}
+        for move_number, player_id, stone_id in result:
+            moves.setdefault(move_number, []).append((player_id, stone_id))
+        for move_number, choices in moves.items():
+            move = MoveState(self.__round, move_number, [player_id for player_id, _ in choices])
+            for player_id, stone_id in choices:
+                move.choose(player_id, stone_id)
+            if move_number == self.__move_number:
+                self.__move = move
+                # leaving stones is not distinguished from not choosing in the logs
+                self.__coordinator.start_move(move.player_ids.tolist())
+                for player_id, stone_id in choices:
+                    if stone_id is not None:
+                        self.__coordinator.decide(player_id)
+            else:
+                self.__last_move = move
+        self.__field_snapshot = None
+
+    async def __flush_choices(self) -> None:
+        """
+        Writes the pending choices at a boundary of a move. Called before the connection for the boundary
+        is taken: the log writer takes a connection of its own, holding two at once may exhaust the pool.
+        """
+        try:
+            await self.__log_writer.flush()
+        except DatabaseError as e:
+            raise ActionException(e.sqlstate) from e
+        except Exception as e:
+            raise ActionException() from e
+
+    async def __save_choices(self, round_number: int, move_number: int, choices: list[tuple[int, Optional[int]]]):
+        """
+        Writes choices of players to the logs with a single statement, used by the log writer.
+        """
+        await do_request("""
+        UPDATE public.logs AS logs
+        SET stone_id = picks.stone_id
+        FROM unnest(%s::bigint[], %s::int[]) AS picks(player_id, stone_id)
+        WHERE logs.lobby_id = %s AND logs.player_id = picks.player_id
+        AND logs.round_number = %s AND logs.move_number = %s;""",
+            ([player_id for player_id, _ in choices], [stone_id for _, stone_id in choices],
+             self.__lobby_id, round_number, move_number),
+            prepare=True)
+
+    def choose(self, player_id: int, stone_id: Optional[int]) -> None:
+        """
+        Sets the stone chosen by the player in the current move (None to leave stones).
+        The choice is applied in memory at once and written to the logs in background.
+        """
+        if hasattr(self, '__database_consistent'):
+            raise ActionException(_NOT_SYNCHRONIZED_WITH_DATABASE)
+        if self.__deleted:
+            raise ActionException(_DATA_DELETED)
+        if self.__status != 'started':
+            raise ActionException(_GAME_IS_NOT_RUNNING)
+        if self.__move is None or player_id not in self.__move:
+            raise ActionException(_NOT_IN_LOBBY)
+        # the result of the move is already computed, a late choice would be logged but lost from it
+        if self.__coordinator.is_closed():
+            raise ActionException(_MOVE_IS_ENDING)
+        self.__move.choose(player_id, stone_id)
+        self.__coordinator.decide(player_id)
+        if self.__move_number <= 1:
+            # the first move shows its own choices on the field
+            self.__field_snapshot = None
+        self.__log_writer.add(self.__round, self.__move_number, player_id, stone_id)
 
     @property
     def move_max_duration_ms(self):
@@ -262,20 +422,21 @@ class Lobby:
                                 UPDATE public.\"user\"
                                 SET current_lobby_id = %s
                                 WHERE public.\"user\".tg_id = %s;
-                                """ % (self.__lobby_id, user.id))
+                                """, (self.__lobby_id, user.id))
                 await cursor.execute("""
-                                INSERT INTO lobby_%s.\"player_list\" (player_id)
-                                VALUES(%s);
-                                """ % (self.__lobby_id, user.id,))
+                                INSERT INTO public.player_list (lobby_id, player_id)
+                                VALUES(%s, %s);
+                                """, (self.__lobby_id, user.id))
                 if not user.is_admin():
                     await cursor.execute("""
                                     UPDATE public.\"lobby\"
                                     SET num_players = num_players + 1
                                     WHERE public.\"lobby\".id = %s;
-    
-                                    """ % (self.__lobby_id,))
+                                    """, (self.__lobby_id,))
                     self.__num_players += 1
                 user.set_lobby(self)
+                if self.__members is not None:
+                    self.__members[user.id] = user
             except DatabaseError as e:
                 await conn.rollback()
                 raise ActionException(e.sqlstate) from e
@@ -291,9 +452,22 @@ class Lobby:
             raise ActionException(_NOT_SYNCHRONIZED_WITH_DATABASE)
         if self.__deleted:
             raise ActionException(_DATA_DELETED)
-        result = await do_request(
-            f"SELECT player_id FROM lobby_{self.__lobby_id}.\"player_list\"")
-        return [await User.add_or_get(user[0]) for user in result]
+        return list((await self.__roster()).values())
+
+    async def __roster(self) -> dict[int, 'User']:
+        """
+        Returns members of the lobby by tg_id. They are loaded with one query on first use
+        and then kept up to date by join_user, kick_user and end_game.
+        """
+        if self.__members is None:
+            result = await do_request("""
+            SELECT u.id, u.tg_id, u.status, u.current_lobby_id
+            FROM public.player_list AS players
+            JOIN public.\"user\" AS u ON u.tg_id = players.player_id
+            WHERE players.lobby_id = %s
+            ORDER BY players.id;""", (self.__lobby_id,))
+            self.__members = {row[1]: User.from_row(row, self.chosen_stone(row[1])) for row in result}
+        return self.__members
 
     async def players(self):
         user_list = await self.users()
@@ -304,7 +478,7 @@ class Lobby:
             raise ActionException(_NOT_SYNCHRONIZED_WITH_DATABASE)
         if self.__deleted:
             raise ActionException(_DATA_DELETED)
-        if user.id not in list(map(lambda x: x.id, await self.users())):
+        if user.id not in await self.__roster():
             raise ActionException(_NO_SUCH_ELEMENT)
         async with connection_pool.connection() as conn:
             try:
@@ -313,21 +487,26 @@ class Lobby:
                                 UPDATE public.\"user\"
                                 SET current_lobby_id = NULL
                                 WHERE public.\"user\".tg_id = %s;
-                                """ % (user.id,))
+                                """, (user.id,))
 
                 await cursor.execute("""
-                                DELETE from lobby_%s.\"player_list\"
-                                WHERE player_id=%s;
-                                """ % (self.__lobby_id, user.id,))
+                                DELETE from public.player_list
+                                WHERE lobby_id = %s AND player_id = %s;
+                                """, (self.__lobby_id, user.id))
 
                 if not user.is_admin():
                     await cursor.execute("""
                                     UPDATE public.\"lobby\"
                                     SET num_players = num_players - 1
                                     WHERE public.\"lobby\".id = %s;
-                                    """ % (self.__lobby_id,))
+                                    """, (self.__lobby_id,))
 
                     self.__num_players -= 1
+                if self.__members is not None:
+                    self.__members.pop(user.id, None)
+                # the move must not wait for a player who has gone
+                if self.__status == 'started' and self.__move is not None and user.id in self.__move:
+                    self.__coordinator.decide(user.id)
             except DatabaseError as e:
                 await conn.rollback()
                 raise ActionException(e.sqlstate) from e
@@ -339,25 +518,34 @@ class Lobby:
             await conn.commit()
 
     async def real_to_fake_stone_name(self, user_id, stone_id):
+        """
+        Returns the id under which the user sees the stone, for an array of ids – an array.
+        """
         if hasattr(self, '__database_consistent'):
             raise ActionException(_NOT_SYNCHRONIZED_WITH_DATABASE)
         if self.__deleted:
             raise ActionException(_DATA_DELETED)
-        if not self.__stones_namings:
+        if self.__stones_namings is None:
+            raise ActionException(_NO_SUCH_ELEMENT)
+        try:
+            return self.__stones_namings.to_fake(user_id, stone_id)
+        except KeyError:
             raise ActionException(_NO_SUCH_ELEMENT)
-        return self.__stones_namings[user_id][stone_id - 1]
 
     async def fake_to_real_stone_name(self, user_id, stone_id):
+        """
+        Returns the real id of the stone seen by the user under stone_id, for an array of ids – an array.
+        """
         if hasattr(self, '__database_consistent'):
             raise ActionException(_NOT_SYNCHRONIZED_WITH_DATABASE)
         if self.__deleted:
             raise ActionException(_DATA_DELETED)
-        if not self.__stones_namings:
+        if self.__stones_namings is None:
             raise ActionException(_NO_SUCH_ELEMENT)
-        result = self.__stones_namings[user_id].index(stone_id)
-        if result == -1:
+        try:
+            return self.__stones_namings.to_real(user_id, stone_id)
+        except KeyError:
             raise ActionException(_NO_SUCH_ELEMENT)
-        return result + 1
 
     async def start_game(self):
         """
@@ -377,29 +565,22 @@ class Lobby:
                                 UPDATE public.\"lobby\"
                                 SET status = 'waiting', round = %s
                                 WHERE public.\"lobby\".id = %s;
-                                """ % (self.__round, self.__lobby_id))
+                                """, (self.__round, self.__lobby_id))
                 user_list = await self.players()
+                import numpy as np
+
                 namings_generator = player_naming_generator()
                 player_namings = [next(namings_generator) for _ in range(self.__num_players)]
                 np.random.shuffle(player_namings)
 
-                await cursor.execute(
-                    """DROP TABLE IF EXISTS lobby_%s.\"player_namings\";""" %
-                    (self.__lobby_id,))
-                await cursor.execute(
-                    """CREATE TABLE IF NOT EXISTS lobby_%s.\"player_namings\"
-                    (
-                       player_id bigint not null,
-                       naming varchar(16) not null
-                    );""" %
-                    (self.__lobby_id,))
-
-                for i, player_naming in enumerate(player_namings):
-                    await cursor.execute(
-                        """INSERT INTO lobby_%s.\"player_namings\"
-                        VALUES (%s, '%s');""" %
-                        (self.__lobby_id, user_list[i].id, player_naming))
+                await cursor.execute("""DELETE FROM public.player_namings WHERE lobby_id = %s;""",
+                                     (self.__lobby_id,))
+                await cursor.execute("""
+                    INSERT INTO public.player_namings (lobby_id, player_id, naming)
+                    SELECT %s, * FROM unnest(%s::bigint[], %s::varchar[]);""",
+                    (self.__lobby_id, [user.id for user in user_list], list(player_namings[:len(user_list)])))
 
+                self.__player_namings = dict(zip([user.id for user in user_list], player_namings))
                 self.__status = 'waiting'
             except DatabaseError as e:
                 await conn.rollback()
@@ -410,6 +591,7 @@ class Lobby:
             finally:
                 await cursor.close()
             await conn.commit()
+        self.__state_notifier.notify(self.__status)
 
     async def start_round(self):
         """
@@ -428,47 +610,42 @@ class Lobby:
                 stones_matrix = gen_rnd_matrix(self.__num_players, self.__current_stones_cnt)
                 user_list = await self.players()
 
-                self.__stones_namings = {}
+                stones_namings = {user.id: naming for naming, user in zip(stones_matrix, user_list)}
+                await cursor.execute("""DELETE FROM public.stones_namings WHERE lobby_id = %s;""",
+                                     (self.__lobby_id,))
                 await cursor.execute("""
-                       DROP TABLE IF EXISTS lobby_%s.\"stones_namings\";
-                       """ % (self.__lobby_id,))
-
-                columns_stones = ',\n'.join(
-                    [f"\"{str(stone_num)}\" int not null" for stone_num in range(1, self.__current_stones_cnt + 1)])
-
-                await cursor.execute(
-                    """CREATE TABLE IF NOT EXISTS lobby_%s.\"stones_namings\"
-                    (
-                       player_id bigint not null,
-                       %s
-                    );""" %
-                    (self.__lobby_id, columns_stones,))
-                for stones_namings, user in zip(stones_matrix, user_list):
-                    self.__stones_namings[user.id] = stones_namings
-                    await cursor.execute("""
-                           INSERT INTO lobby_%s.\"stones_namings\" 
-                           VALUES(%s, %s);
-                           """ % (self.__lobby_id, user.id, ','.join(map(str, stones_namings))))
+                    INSERT INTO public.stones_namings (lobby_id, player_id, real, fake)
+                    SELECT %s, * FROM unnest(%s::bigint[], %s::int[], %s::int[]);""",
+                    (self.__lobby_id,
+                     [user.id for user in user_list for _ in range(self.__current_stones_cnt)],
+                     [stone_id for _ in user_list for stone_id in range(1, self.__current_stones_cnt + 1)],
+                     [fake_id for user in user_list for fake_id in stones_namings[user.id]]))
+                self.__stones_namings = StoneNamings(stones_namings)
 
                 await cursor.execute(
-                    """INSERT INTO lobby_%s.\"stones_list\" (round_num, move_num, stones) VALUES
+                    """INSERT INTO public.stones_list (lobby_id, round_num, move_num, stones) VALUES
                     (
                         %s,
                         %s,
-                        '%s'
-                    );""" %
+                        %s,
+                        %s
+                    );""",
                     (self.__lobby_id, self.__round + 1, 1, ','.join(list(map(str, range(1, self.__current_stones_cnt + 1))))))
 
                 await cursor.execute("""
                                 UPDATE public.\"lobby\"
                                 SET status = 'started', round = %s, current_stones_cnt = %s
                                 WHERE public.\"lobby\".id = %s;
-                                """ % (self.__round + 1, self.__default_stones_cnt, self.__lobby_id))
+                                """, (self.__round + 1, self.__default_stones_cnt, self.__lobby_id))
                 self.__status = 'started'
                 self.__round += 1
                 self.__move_number = 1
                 self.__stones_set = {1: set(range(1, self.__default_stones_cnt + 1))}
-                await self.start_move_logs()
+                self.__move = MoveState(self.__round, self.__move_number, [user.id for user in user_list])
+                self.__coordinator.start_move(self.__move.player_ids.tolist())
+                self.__last_move = None
+                self.__field_snapshot = None
+                await self.start_move_logs(cursor, user_list)
             except DatabaseError as e:
                 await conn.rollback()
                 raise ActionException(e.sqlstate) from e
@@ -478,6 +655,9 @@ class Lobby:
             finally:
                 await cursor.close()
             await conn.commit()
+        self.__state_notifier.notify(self.__status)
+        self.__events.publish({'type': 'round_started', 'round': self.__round, 'stones_left': self.__current_stones_cnt})
+        self.__events.publish({'type': 'move_started', 'round': self.__round, 'move': self.__move_number})
 
     async def end_game(self):
         """
@@ -492,24 +672,26 @@ class Lobby:
         async with connection_pool.connection() as conn:
             try:
                 cursor = conn.cursor()
-                for player in await self.users():
-                    await cursor.execute("""
-                                            UPDATE public.\"user\"
-                                            SET current_lobby_id = NULL
-                                            WHERE public.\"user\".tg_id = %s;
-                                            """ % (player.id,))
+                user_list = await self.users()
+                await cursor.execute("""
+                                        UPDATE public.\"user\"
+                                        SET current_lobby_id = NULL
+                                        WHERE public.\"user\".current_lobby_id = %s;
+                                        """, (self.__lobby_id,))
+                for player in user_list:
                     player.set_lobby(None)
 
                 await cursor.execute("""
                                  UPDATE public.\"lobby\"
                                  SET status = 'finished', num_players = 0
                                  WHERE public.\"lobby\".id = %s;
-                                 """ % (self.__lobby_id,))
+                                 """, (self.__lobby_id,))
                 await cursor.execute("""
-                                         TRUNCATE table lobby_%s.\"player_list\";
-                                         """ % (self.__lobby_id,))
+                                         DELETE FROM public.player_list WHERE lobby_id = %s;
+                                         """, (self.__lobby_id,))
                 self.__status = 'finished'
                 self.__num_players = 0
+                self.__members = {}
             except DatabaseError as e:
                 await conn.rollback()
                 raise ActionException(e.sqlstate) from e
@@ -519,6 +701,9 @@ class Lobby:
             finally:
                 await cursor.close()
             await conn.commit()
+        self.__state_notifier.notify(self.__status)
+        self.__release_move_waiters()
+        self.__events.publish({'type': 'game_ended'})
 
     async def end_round(self):
         """
@@ -530,6 +715,8 @@ class Lobby:
             raise ActionException(_DATA_DELETED)
         if self.__status != 'started':
             raise ActionException(_GAME_IS_NOT_RUNNING)
+        await self.__flush_choices()
+        user_list = await self.players()
 
         async with connection_pool.connection() as conn:
             try:
@@ -537,13 +724,13 @@ class Lobby:
 
                 await cursor.execute("""
                            UPDATE public.\"lobby\"
-                           SET round = %s, current_stones_cnt = %s, status = 'waiting'
+                           SET current_stones_cnt = %s, status = 'waiting'
                            WHERE public.\"lobby\".id = %s;
-                           """ % (self.__round + 1, len(self.__stones_set[self.__move_number]), self.__lobby_id))
+                           """, (len(self.__stones_set[self.__move_number]), self.__lobby_id))
 
-                for user in (await self.players()):
-                    if user.chosen_stone is not None:
-                        await user.leave_stone()
+                # the last move has already been ended, so the logs hold no choices to reset
+                for user in user_list:
+                    user.chosen_stone = None
 
                 self.__status = 'waiting'
             except DatabaseError as e:
@@ -555,10 +742,14 @@ class Lobby:
             finally:
                 await cursor.close()
             await conn.commit()
+        self.__state_notifier.notify(self.__status)
+        self.__events.publish({'type': 'round_ended', 'round': self.__round,
+                               'stones_left': len(self.__stones_set[self.__move_number])})
 
-    async def end_move(self):
+    async def end_move(self, is_last: bool = False):
         """
-        Ends the current move.
+        Ends the current move and wakes everyone waiting for it.
+        :param is_last: True if the round is over after this move (e.g. time is up)
         """
         if hasattr(self, '__database_consistent'):
             raise ActionException(_NOT_SYNCHRONIZED_WITH_DATABASE)
@@ -566,48 +757,127 @@ class Lobby:
             raise ActionException(_DATA_DELETED)
         if self.__status != 'started':
             raise ActionException(_GAME_IS_NOT_RUNNING)
-        choices = await do_request("""
-               SELECT stone_id FROM lobby_%s.\"logs\" where round_number = %s AND move_number = %s;""" % (
-        self.__lobby_id, self.__round, self.__move_number))
-        for stone_id in list(self.__stones_set[self.__move_number]):
-            if len(list(filter(lambda x: x[0] == stone_id, choices))) == 2:
-                self.__stones_set[self.__move_number].remove(stone_id)
+        self.__coordinator.close_move()
+        try:
+            removed_stones = self.__move.removed_stones(self.__stones_set[self.__move_number])
+            # the state of the lobby changes only once the next move is in the database
+            stones_left = self.__stones_set[self.__move_number].difference(removed_stones)
+            # the logs of the move must be complete before rows of the next one appear
+            await self.__flush_choices()
+            user_list = await self.players()
 
-        async with connection_pool.connection() as conn:
-            try:
-                cursor = conn.cursor()
+            async with connection_pool.connection() as conn:
+                try:
+                    cursor = conn.cursor()
 
-                for player in await self.players():
                     await cursor.execute("""
-                       INSERT INTO lobby_%s.\"logs\" (player_id, stone_id, round_number, move_number) VALUES (%s, NULL, %s, %s)""" % (
-                        self.__lobby_id, player.id, self.__round, self.__move_number + 1))
+                               INSERT INTO public.stones_list (lobby_id, round_num, move_num, stones) VALUES (
+                               %s,
+                               %s,
+                               %s,
+                               %s)
+                               """, (
+                        self.__lobby_id, self.__round, self.__move_number + 1,
+                        ','.join(list(map(str, stones_left)))), prepare=True)
+
+                    await self.start_move_logs(cursor, user_list, self.__move_number + 1)
+                except DatabaseError as e:
+                    await conn.rollback()
+                    raise ActionException(e.sqlstate) from e
+                except Exception as e:
+                    await conn.rollback()
+                    raise ActionException() from e
+                finally:
+                    await cursor.close()
+                await conn.commit()
+        except BaseException:
+            # the move goes on as if nobody tried to end it
+            self.__coordinator.reopen_move()
+            raise
+
+        self.__stones_set[self.__move_number] = stones_left
+        self.__move_number += 1
+        self.__last_move = self.__move
+        self.__move = MoveState(self.__round, self.__move_number, [user.id for user in user_list])
+        self.__coordinator.start_move(self.__move.player_ids.tolist())
+        self.__field_snapshot = None
+
+        # log rows of the new move are inserted without a stone
+        for user in user_list:
+            user.chosen_stone = None
+
+        self.__stones_set[self.__move_number] = stones_left.copy()
+        self.__current_stones_cnt = len(stones_left)
+        result = {
+            'round': self.__round,
+            'move': self.__move_number - 1,
+            'removed_stones': removed_stones,
+            'stones_left': self.__current_stones_cnt,
+            'round_ended': is_last or self.__current_stones_cnt == 0
+        }
+        self.__move_notifier.notify(result)
+        # the namings change with the round, a subscriber lagging behind needs the ones of this move
+        self.__events.publish({'type': 'move_ended', 'namings': self.__stones_namings} | result)
+        if not result['round_ended']:
+            self.__events.publish({'type': 'move_started', 'round': self.__round, 'move': self.__move_number})
+
+    def __release_move_waiters(self) -> None:
+        """
+        Wakes everyone waiting for the current move when the game stops without ending it.
+        """
+        self.__move_notifier.notify({
+            'round': self.__round,
+            'move': self.__move_number,
+            'removed_stones': [],
+            'stones_left': self.__current_stones_cnt,
+            'round_ended': True
+        })
+
+    def move_waiter(self) -> asyncio.Future:
+        """
+        Returns a future resolved with the result of the current move when it ends.
+        Take it before making a choice so that the end of the move can't be missed.
+        """
+        return self.__move_notifier.waiter()
 
-                await cursor.execute("""
-                           INSERT INTO lobby_%s.\"stones_list\" (round_num, move_num, stones) VALUES (
-                           %s,
-                           %s,
-                           '%s')
-                           """ % (
-                    self.__lobby_id, self.__round, self.__move_number + 1,
-                    ','.join(list(map(str, self.__stones_set[self.__move_number])))))
-
-                self.__move_number += 1
-
-                for user in (await self.players()):
-                    if user.chosen_stone is not None:
-                        await user.leave_stone()
-
-                self.__stones_set[self.__move_number] = self.__stones_set[self.__move_number - 1].copy()
-                self.__current_stones_cnt = len(self.__stones_set[self.__move_number])
-            except DatabaseError as e:
-                await conn.rollback()
-                raise ActionException(e.sqlstate) from e
-            except Exception as e:
-                await conn.rollback()
-                raise ActionException() from e
-            finally:
-                await cursor.close()
-            await conn.commit()
+    async def wait_move_end(self, timeout: Optional[float] = None, waiter: Optional[asyncio.Future] = None) -> dict:
+        """
+        Waits until the current move ends and returns its result: round and move numbers,
+        removed stones (real ids), number of stones left and whether the round has ended.
+        """
+        return await self.__move_notifier.wait(timeout, waiter)
+
+    async def wait_for_status(self, *statuses: str, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until the lobby gets one of the given statuses.
+        Wakes up only on status changes, returns False if timeout (in seconds) expires.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self.status() not in statuses:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            try:
+                await self.__state_notifier.wait(remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def events(self) -> EventBus:
+        """
+        Returns the bus of the game events: round_started, move_started, move_ended (with the result
+        of the move as wait_move_end returns it and the stone namings of its round), round_ended and game_ended.
+        game_ended is published when the lobby is deleted as well.
+        """
+        return self.__events
+
+    def coordinator(self) -> MoveCoordinator:
+        """
+        Returns the object deciding when the current move ends: the move loop waits for its signals,
+        choices of players are marked in it by choose().
+        """
+        return self.__coordinator
 
     def number_of_players(self) -> int:
         """
@@ -659,11 +929,19 @@ class Lobby:
             raise ActionException(_DATA_DELETED)
         return self.__status
 
-    async def start_move_logs(self):
-        for player in await self.players():
-            await do_request("""
-               INSERT INTO lobby_%s.\"logs\" (player_id, stone_id, round_number, move_number) VALUES (%s, %s, %s, %s)""" % (
-                self.__lobby_id, player.id, 'NULL', self.__round, self.__move_number))
+    async def start_move_logs(self, cursor, players: list, move_number: Optional[int] = None) -> None:
+        """
+        Inserts empty log rows of a move for all the given players with a single statement.
+        :param move_number: the move of the rows, the current one by default
+        """
+        if not players:
+            return
+        if move_number is None:
+            move_number = self.__move_number
+        await cursor.execute("""
+           INSERT INTO public.logs (lobby_id, player_id, stone_id, round_number, move_number)
+           SELECT %s, player_id, NULL, %s, %s FROM unnest(%s::bigint[]) AS player_id""",
+            (self.__lobby_id, self.__round, move_number, [player.id for player in players]), prepare=True)
 
     def stones_left(self) -> int:
         """
@@ -684,62 +962,145 @@ class Lobby:
             raise ActionException(_NOT_SYNCHRONIZED_WITH_DATABASE)
         if self.__deleted:
             raise ActionException(_DATA_DELETED)
-        result = await do_request("""
-               SELECT * FROM lobby_%s.\"player_namings\"""" % (self.__lobby_id,))
-        return {x[0]: x[1] for x in result}
+        if self.__player_namings is None:
+            result = await do_request("""
+                   SELECT player_id, naming FROM public.player_namings WHERE lobby_id = %s""",
+                                      (self.__lobby_id,), prepare=True)
+            self.__player_namings = {x[0]: x[1] for x in result}
+        return self.__player_namings
+
+    async def __field(self) -> dict[int, list[tuple[int, str]]]:
+        """
+        Returns players (id and fake name) at every stone left after the shown move, key 0 - players aside.
+        Built once per move and shared by all the users.
+        """
+        if self.__field_snapshot is None:
+            shown_move = self.__last_move if self.__move_number > 1 else self.__move
+            stones = self.__stones_set[max(1, self.__move_number - 1)]
+            fake_namings = await self.player_naming()
+            field = {stone_id: [] for stone_id in stones}
+            field[0] = []
+            for stone_id, players in enumerate(shown_move.players_by_stone(self.__default_stones_cnt)):
+                # players at stones removed in the shown move are shown as standing aside
+                field[stone_id if stone_id in stones else 0].extend(
+                    (player_id, fake_namings[player_id]) for player_id in players.tolist())
+            self.__field_snapshot = field
+        return self.__field_snapshot
 
     async def field_for_user(self, user) -> dict[int, tuple[bool, list[int]]]:
         """
         Returns the field for a user.
         """
+        field = (await self.fields_for_users([user]))[user.id]
+        if isinstance(field, ActionException):
+            raise field
+        return field
+
+    async def fields_for_users(self, users: list) -> dict[int, dict[int, tuple[bool, list[int]]] | ActionException]:
+        """
+        Returns the fields for many users by tg_id. The field is built once and its stones are
+        translated to the names seen by all the users with one lookup.
+        A user who can't see the field (out of the lobby or out of the shown move) gets the error instead.
+        """
         if hasattr(self, '__database_consistent'):
             raise ActionException(_NOT_SYNCHRONIZED_WITH_DATABASE)
         if self.__deleted:
             raise ActionException(_DATA_DELETED)
-        if user.id not in list(map(lambda x: x.id, await self.users())):
-            raise ActionException(_NOT_IN_LOBBY)
-        result = {await self.real_to_fake_stone_name(user.id, stone_id): (False, []) for stone_id in self.__stones_set[max(1, self.__move_number-1)]}
-        choices = await do_request("""
-                       SELECT stone_id, player_id FROM lobby_%s.\"logs\" where round_number = %s and move_number = %s;""" % (
-            self.__lobby_id, self.__round, max(1, self.__move_number - 1),))
-        fake_namings = await self.player_naming()
-        if choices:
-            for stone_id in self.__stones_set[max(1, self.__move_number - 1)]:
-                stone_id_fake = await self.real_to_fake_stone_name(user.id, stone_id)
-                result[stone_id_fake] = (
-                    False, list(map(lambda x: fake_namings[x[1]], filter(lambda x: x[0] == stone_id and x[1] != user.id,
-                                                                         choices))))
-            result[0] = (
-                False, list(map(lambda x: fake_namings[x[1]], filter(lambda x: (x[0] is None or x[0] not in self.__stones_set[max(1, self.__move_number - 1)]) and x[1] != user.id,
-                                                                     choices))))
-        user_log = list(filter(lambda x: x[1] == user.id, choices))
-        if not user_log:
-            raise ActionException()
-        choice = user_log[0]
-        if choice and choice[0] is not None and choice[0] in self.__stones_set[max(1, self.__move_number - 1)]:
-            fake_choice = await self.real_to_fake_stone_name(user.id, choice[0])
-            result[fake_choice] = (True, result[fake_choice][1])
-        elif choice and (choice[0] is None or choice[0] not in self.__stones_set[max(1, self.__move_number - 1)]):
-            result[0] = (True, result[0][1])
-        return result
-
-    async def get_logs(self) -> str:
-        """
-        Creates logs files .csv
-        :return: filepath
-        """
-        path = os.path.join(f'{os.getenv('TEMP_DIR')}/logs_{self.__lobby_id}_{time.time()}.csv')
-        result = await do_request("SELECT * FROM lobby_%s.\"logs\";" % (self.__lobby_id,))
-        columns = await do_request("SELECT column_name FROM information_schema.columns WHERE table_name = 'logs' and table_schema = 'lobby_%s';" % (self.__lobby_id,))
-        pd.DataFrame(result, columns=list(map(lambda x: x[0], columns))).sort_values(
-            by=["round_number", "move_number"]).to_csv(path, index=False)
-        return path
+        roster = await self.__roster()
+        shown_move = self.__last_move if self.__move_number > 1 else self.__move
+        results = {}
+        viewers = []
+        for user in users:
+            if user.id not in roster:
+                results[user.id] = ActionException(_NOT_IN_LOBBY)
+            elif user.id not in shown_move:
+                results[user.id] = ActionException()
+            else:
+                viewers.append(user)
+        if not viewers:
+            return results
+        field = await self.__field()
+        if self.__stones_namings is None:
+            raise ActionException(_NO_SUCH_ELEMENT)
+        try:
+            fake_stone_ids = self.__stones_namings.to_fake_many([user.id for user in viewers], list(field)).tolist()
+        except KeyError:
+            raise ActionException(_NO_SUCH_ELEMENT)
+        for user, user_stone_ids in zip(viewers, fake_stone_ids):
+            choice = shown_move.stone_of(user.id)
+            if choice not in field:
+                choice = 0
+            results[user.id] = {
+                fake_stone_id: (stone_id == choice, [naming for player_id, naming in players if player_id != user.id])
+                for fake_stone_id, (stone_id, players) in zip(user_stone_ids, field.items())
+            }
+        return results
+
+    async def export_logs(self, output: BinaryIO, log_format: str = 'csv') -> None:
+        """
+        Streams the logs of the lobby ordered by round, move and player into output chunk by chunk.
+        :param log_format: 'csv', 'csv.gz' (gzipped csv) or 'parquet' (needs pyarrow)
+        """
+        if hasattr(self, '__database_consistent'):
+            raise ActionException(_NOT_SYNCHRONIZED_WITH_DATABASE)
+        if self.__deleted:
+            raise ActionException(_DATA_DELETED)
+        if log_format not in LOG_FORMATS:
+            raise ActionException(_NO_SUCH_ELEMENT)
+        if log_format == 'parquet':
+            try:
+                import pyarrow
+            except ImportError as e:
+                raise ActionException(_PARQUET_UNAVAILABLE) from e
+        await self.__log_writer.flush()
+        query = f"""
+        SELECT {', '.join(_LOG_COLUMNS)} FROM public.logs
+        WHERE lobby_id = %s
+        ORDER BY round_number, move_number, player_id"""
+        async with connection_pool.connection() as conn:
+            if log_format == 'parquet':
+                await self.__export_parquet(conn, query, output)
+                return
+            compressor = zlib.compressobj(wbits=31) if log_format == 'csv.gz' else None
+            async with conn.cursor() as cursor:
+                async with cursor.copy(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)",
+                                       (self.__lobby_id,)) as copy:
+                    async for chunk in copy:
+                        output.write(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                output.write(compressor.flush())
+
+    async def __export_parquet(self, conn, query: str, output: BinaryIO) -> None:
+        """
+        Writes the rows of the query to output as parquet, one row group per fetched batch.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([('date_time', pa.timestamp('us')), ('player_id', pa.int64()), ('stone_id', pa.int32()),
+                            ('round_number', pa.int32()), ('move_number', pa.int32())])
+        # a named cursor is a server-side one, rows are fetched in batches instead of all at once
+        async with conn.cursor(name=f'logs_export_{self.__lobby_id}') as cursor:
+            await cursor.execute(query, (self.__lobby_id,))
+            with pq.ParquetWriter(output, schema) as writer:
+                while rows := await cursor.fetchmany(_EXPORT_BATCH_SIZE):
+                    writer.write_batch(pa.RecordBatch.from_arrays(
+                        [pa.array(column, type=field.type) for column, field in zip(zip(*rows), schema)],
+                        schema=schema))
+
+    async def get_logs(self, log_format: str = 'csv') -> bytes:
+        """
+        Returns the logs of the lobby as a file content in the given format (see export_logs).
+        """
+        buffer = io.BytesIO()
+        await self.export_logs(buffer, log_format)
+        return buffer.getvalue()
 
     async def last_round_started(self) -> datetime.datetime:
         result = await do_request("""
-        select date_time from lobby_%s.logs where round_number = %s
+        select date_time from public.logs where lobby_id = %s and round_number = %s
         limit 1;
-        """ % (self.__lobby_id, self.__round,))
+        """, (self.__lobby_id, self.__round))
         return result[0][0]
 
     async def delete(self):
@@ -750,20 +1111,37 @@ class Lobby:
             raise ActionException(_NOT_SYNCHRONIZED_WITH_DATABASE)
         if self.__deleted:
             raise ActionException(_DATA_DELETED)
-        try:
-            await do_request("""
-            DROP SCHEMA lobby_%s CASCADE;
-
-            DELETE from public.\"lobby\"
-            WHERE id=%s;
-            """ % (self.__lobby_id, self.__lobby_id,))
-        except DatabaseError as e:
-            raise ActionException(e.sqlstate) from e
-        except Exception as e:
-            raise ActionException() from e
+        async with connection_pool.connection() as conn:
+            try:
+                cursor = conn.cursor()
+                # rows of the lobby in the shared tables are deleted by ON DELETE CASCADE
+                await cursor.execute("""
+                DELETE from public.\"lobby\"
+                WHERE id=%s;
+                """, (self.__lobby_id,))
+            except DatabaseError as e:
+                await conn.rollback()
+                raise ActionException(e.sqlstate) from e
+            except Exception as e:
+                await conn.rollback()
+                raise ActionException() from e
+            finally:
+                await cursor.close()
+            await conn.commit()
 
         self.__deleted = True
         Lobby.__instances.pop(self.__lobby_id)
+        self.__state_notifier.notify(None)
+        self.__release_move_waiters()
+        self.__events.publish({'type': 'game_ended'})
+
+    def chosen_stone(self, player_id: int) -> Optional[int]:
+        """
+        Returns the stone chosen by the player in the current move.
+        """
+        if self.__status != 'started' or self.__move is None or player_id not in self.__move:
+            return None
+        return self.__move.stone_of(player_id)
 
     def stones_set(self) -> set[int]:
         if hasattr(self, '__database_consistent'):
@@ -782,6 +1160,7 @@ class User:
     """
 
     SUPREME_ADMIN_ID = None
+    # identity map by tg_id
     __instances: dict[int, 'User'] = {}
 
     def __init__(self, user_id: int, tg_id: int, status: str = 'player', current_lobby_id: int = None,
@@ -795,12 +1174,12 @@ class User:
 
     def __new__(cls, user_id: int, tg_id: int, status: str = 'player', current_lobby_id: int = None,
                 chosen_stone: int = None):
-        if user_id in cls.__instances:
-            return cls.__instances[user_id]
+        if tg_id in cls.__instances:
+            return cls.__instances[tg_id]
 
         logging.debug(f"User {user_id} created")
         instance = super(User, cls).__new__(cls)
-        cls.__instances[user_id] = instance
+        cls.__instances[tg_id] = instance
         return instance
 
     
@@ -823,31 +1202,91 @@ class User:
     @classmethod
     async def add_or_get(cls, tg_id: int, status: str = 'player'):
         """
-        Returns User object with given tg_id or creates it in database
+        Returns User object with given tg_id or creates it in database.
+        Cached users are returned without querying the database, status is used only for new users.
         """
+        if tg_id in cls.__instances:
+            return cls.__instances[tg_id]
+
+        # no-op update on conflict, so that RETURNING gives the row of an existing user as well
         result = await do_request("""
-        SELECT * FROM public.\"user\"
-        WHERE tg_id = %s;
-        """ % (tg_id,))
+        INSERT INTO public.\"user\" (tg_id, status)
+        VALUES (%s, %s)
+        ON CONFLICT (tg_id) DO UPDATE SET tg_id = EXCLUDED.tg_id
+        RETURNING *;""", (tg_id, status), prepare=True)
+        result = result[0]
 
-        if len(result) == 0:
-            result = await do_request("""
-            INSERT INTO public.\"user\" (tg_id, status)
-            VALUES (%s, '%s') RETURNING *;""" % (tg_id, status))
+        self = cls.from_row(result)
+        if result[3] is not None:
+            # the user may be restored in the middle of a move, e.g. after a restart
+            self.chosen_stone = (await Lobby.get_lobby(result[3])).chosen_stone(tg_id)
+        return self
 
-        chosen_stone = await do_request("""
-        SELECT stone_id FROM lobby_%s.\"logs\" where player_id = %s
-        ORDER BY date_time DESC LIMIT 1;""" % (result[0][3], result[0][1])) if result[0][3] is not None else None
+    @classmethod
+    def cached_ids(cls) -> list[int]:
+        """
+        Returns tg_ids of the users kept in memory.
+        """
+        return list(cls.__instances)
 
-        if chosen_stone:
-            chosen_stone = chosen_stone[0][0]
-        else:
-            chosen_stone = None
+    @classmethod
+    def matches_cache(cls, row: dict) -> bool:
+        """
+        Returns True if the row of public."user" holds nothing new for the cached user (or it isn't cached).
+        """
+        self = cls.__instances.get(row['tg_id'])
+        return self is None or (row['status'], row['current_lobby_id']) == (self.__status, self.__current_lobby_id)
 
-        result = result[0]
+    @classmethod
+    def apply_change(cls, operation: str, row: dict) -> None:
+        """
+        Applies a change of a row of public."user" made by another process (or by hand) to the cached user.
+        :param operation: INSERT, UPDATE or DELETE
+        :param row: the row after the change (before it for DELETE)
+        """
+        self = cls.__instances.get(row['tg_id'])
+        if self is None:
+            return
+        if operation == 'DELETE':
+            self.__deleted = True
+            cls.__instances.pop(row['tg_id'], None)
+            return
+        if row['current_lobby_id'] != self.__current_lobby_id:
+            for lobby_id in (self.__current_lobby_id, row['current_lobby_id']):
+                if lobby_id is not None:
+                    Lobby.forget_members(lobby_id)
+            self.chosen_stone = None
+        self.__current_lobby_id = row['current_lobby_id']
+        self.__status = row['status']
 
-        self = cls(user_id=result[0], tg_id=result[1], status=result[2], current_lobby_id=result[3],
-                   chosen_stone=chosen_stone)
+    @classmethod
+    async def get_many(cls, tg_ids: list[int], status: str = 'player') -> dict[int, 'User']:
+        """
+        Returns User objects by tg_id like add_or_get, the users missing in the cache are got
+        or created in database with one query.
+        """
+        missing = [tg_id for tg_id in dict.fromkeys(tg_ids) if tg_id not in cls.__instances]
+        if missing:
+            result = await do_request("""
+            INSERT INTO public.\"user\" (tg_id, status)
+            SELECT tg_id, %s::user_status FROM unnest(%s::bigint[]) AS tg_id
+            ON CONFLICT (tg_id) DO UPDATE SET tg_id = EXCLUDED.tg_id
+            RETURNING *;""", (status, missing), prepare=True)
+            for row in result:
+                self = cls.from_row(row)
+                if row[3] is not None:
+                    self.chosen_stone = (await Lobby.get_lobby(row[3])).chosen_stone(row[1])
+        return {tg_id: cls.__instances[tg_id] for tg_id in tg_ids}
+
+    @classmethod
+    def from_row(cls, row: tuple, chosen_stone: int = None) -> 'User':
+        """
+        Returns User object for a row (id, tg_id, status, current_lobby_id) of public."user".
+        Cached users are returned as they are, since their state in memory is at least as fresh.
+        """
+        if row[1] in cls.__instances:
+            return cls.__instances[row[1]]
+        self = cls(user_id=row[0], tg_id=row[1], status=row[2], current_lobby_id=row[3], chosen_stone=chosen_stone)
         self.__database_consistent = True
         return self
 
@@ -895,9 +1334,9 @@ class User:
             raise ActionException(_NO_SUCH_ELEMENT)
         await do_request("""
         UPDATE public.\"user\"
-        SET status = \'%s\'
+        SET status = %s
         WHERE id = %s;
-        """ % (status, self.__user_id))
+        """, (status, self.__user_id))
         self.__status = status
 
     async def leave_stone(self):
@@ -909,12 +1348,8 @@ class User:
             raise ActionException(_NOT_IN_LOBBY)
         if (await self.lobby()).status() != 'started':
             raise ActionException(_GAME_IS_NOT_RUNNING)
+        (await self.lobby()).choose(self.__tg_id, None)
         self.chosen_stone = None
-        await do_request("""
-        UPDATE lobby_%s.\"logs\"
-        SET stone_id = NULL
-        WHERE player_id = %s AND round_number = %s AND move_number = %s;""" % (
-            self.__current_lobby_id, self.__tg_id, (await self.lobby()).round(), (await self.lobby()).move()))
 
     async def choose_stone(self, stone_id: int):
         """
@@ -937,12 +1372,8 @@ class User:
             wtf = (await self.lobby()).stones_set()
             logging.debug(f'stones_set: {wtf}')
             raise ActionException(_NO_SUCH_STONE)
+        (await self.lobby()).choose(self.__tg_id, stone_id)
         self.chosen_stone = stone_id
-        await do_request("""
-        UPDATE lobby_%s.\"logs\"
-        SET stone_id = %s
-        WHERE player_id = %s AND round_number = %s AND move_number = %s;""" % (
-            self.__current_lobby_id, stone_id, self.__tg_id, (await self.lobby()).round(), (await self.lobby()).move()))
 
     async def delete(self):
         """
@@ -956,14 +1387,14 @@ class User:
             await do_request("""
                 DELETE from public.\"user\"
                 WHERE id=%s;
-                """ % (self.__user_id,))
+                """, (self.__user_id,))
         except DatabaseError as e:
             raise ActionException(e.sqlstate) from e
         except Exception as e:
             raise ActionException() from e
 
         self.__deleted = True
-        User.__instances.pop(self.__user_id)
+        User.__instances.pop(self.__tg_id)
 
     def __str__(self):
         return f'User {self.__user_id} with tg_id {self.__tg_id} and status {self.__status}'
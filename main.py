@@ -1,29 +1,33 @@
 import asyncio
 import logging
 import os
+import secrets
+import subprocess
 import sys
+from urllib.parse import urlsplit
 
 from dotenv import load_dotenv
 
+from database.changes import listen_changes
 from database.query import init_pool, connection_pool
-from database.wrappers import User
-from app.game import main
+from database.wrappers import User, Lobby
+from app.broadcast import GLOBAL_RATE
+from app.game import main, bot
 from data.exception import init_exceptions
 import uvicorn
 from api_utils.api import app
+from sharding.router import Router, front_app, worker_secret, worker_urls
 
+MODES = ('single', 'front', 'worker', 'cluster')
 
-async def start_server():
-    config = uvicorn.Config(app, host="0.0.0.0", port=5000)
+
+async def start_server(server_app=app, host="0.0.0.0", port=5000):
+    config = uvicorn.Config(server_app, host=host, port=port)
     server = uvicorn.Server(config)
     await server.serve()
 
 
-async def entrypoint():
-    await init_pool()
-    async with connection_pool.connection():
-        logging.info("Got the connection to DB")
-        pass
+async def init_supreme_admin():
     supreme_admin_id = os.getenv('SUPREME_ADMIN_ID')
     if supreme_admin_id:
         try:
@@ -33,7 +37,81 @@ async def entrypoint():
             User.SUPREME_ADMIN_ID = int(supreme_admin_id)
         except ValueError:
             logging.error('tg_id of supreme_admin has incorrect format')
-    await asyncio.gather(main(), start_server())
+
+
+async def entrypoint():
+    """
+    Runs the bot and the API in this process.
+    """
+    await init_pool()
+    async with connection_pool.connection():
+        logging.info("Got the connection to DB")
+        pass
+    await init_supreme_admin()
+    # cached lobbies and users follow the changes made by other processes and by hand
+    changes = asyncio.create_task(listen_changes())
+    try:
+        await asyncio.gather(main(), start_server())
+    finally:
+        changes.cancel()
+        await Lobby.flush_logs()
+
+
+async def worker_entrypoint(index: int):
+    """
+    Runs the worker number index: it serves updates and API requests of its lobbies forwarded by the front.
+    """
+    from sharding.worker import router
+
+    url = urlsplit(worker_urls()[index])
+    await init_pool()
+    await init_supreme_admin()
+    app.include_router(router)
+    # the address from the list of workers is the internal one, the worker is not served on other interfaces
+    host = url.hostname
+    changes = asyncio.create_task(listen_changes())
+    try:
+        await start_server(app, host, url.port)
+    finally:
+        changes.cancel()
+        await Lobby.flush_logs()
+
+
+async def front_entrypoint():
+    """
+    Polls Telegram and serves the API on port 5000, passing everything to the workers.
+    """
+    await init_pool()
+    router = Router(worker_urls(), worker_secret())
+    polling = asyncio.create_task(router.poll(bot))
+    try:
+        # the server stops on Ctrl+C, the polling has to be stopped with it
+        await start_server(front_app(router))
+    finally:
+        polling.cancel()
+        await router.close()
+
+
+def run_cluster():
+    """
+    Starts the local workers in subprocesses and runs the front in this process.
+    The connections to the DB and the rate limit of Telegram are shared out between the processes.
+    """
+    workers = len(worker_urls())
+    # the front is run in this process, so it gets the generated secret as well
+    os.environ.setdefault('WORKER_SECRET', secrets.token_urlsafe(32))
+    env = dict(os.environ)
+    max_connections = int(os.getenv('POSTGRES_MAX_CONNECTIONS'))
+    env['POSTGRES_MAX_CONNECTIONS'] = str(10 + (max_connections - 10) // (workers + 1))
+    env['TELEGRAM_GLOBAL_RATE'] = str(GLOBAL_RATE / workers)
+    processes = [subprocess.Popen([sys.executable, __file__, 'worker', str(i)], env=env) for i in range(workers)]
+    try:
+        asyncio.run(front_entrypoint())
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
 
 
 if __name__ == '__main__':
@@ -43,7 +121,18 @@ if __name__ == '__main__':
     load_dotenv()
     logging.basicConfig(level='DEBUG')
 
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'single'
+    if mode not in MODES:
+        sys.exit(f'Unknown mode {mode}, expected one of: {", ".join(MODES)}')
+
     try:
-        asyncio.run(entrypoint())
+        if mode == 'single':
+            asyncio.run(entrypoint())
+        elif mode == 'front':
+            asyncio.run(front_entrypoint())
+        elif mode == 'worker':
+            asyncio.run(worker_entrypoint(int(sys.argv[2])))
+        else:
+            run_cluster()
     except KeyboardInterrupt:
         print('Pressed Ctrl+C. Interrupting...')
@@ -0,0 +1,33 @@
+import bisect
+import hashlib
+from typing import Sequence
+
+# points of every node on the ring, more points give a more even split of keys
+_REPLICAS = 128
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto nodes. Every node owns many points on a circle of 64-bit hashes,
+    a key belongs to the node of the first point after the hash of the key.
+    Adding or removing a node moves only the keys of its own points.
+    """
+
+    def __init__(self, nodes: Sequence[str], replicas: int = _REPLICAS):
+        if not nodes:
+            raise ValueError('Hash ring needs at least one node')
+        points = sorted((_hash(f'{node}#{i}'), node) for node in nodes for i in range(replicas))
+        self.__hashes = [point for point, _ in points]
+        self.__nodes = [node for _, node in points]
+        self.nodes = list(nodes)
+
+    def node_for(self, key: str) -> str:
+        """
+        Returns the node owning the key.
+        """
+        i = bisect.bisect(self.__hashes, _hash(key)) % len(self.__hashes)
+        return self.__nodes[i]
@@ -0,0 +1,229 @@
+"""
+Module providing the front process: it polls Telegram and serves the agent API,
+forwarding every update and request to the worker owning the lobby it concerns.
+"""
+from aiogram import Bot
+from aiogram.types import CallbackQuery, Update
+from fastapi import FastAPI, Request, Response, WebSocket
+from starlette.requests import HTTPConnection
+import httpx
+import websockets
+
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from database.query import do_request
+from .ring import HashRing
+
+_POLL_TIMEOUT = 30
+_RETRY_DELAY = 1
+_CONNECT_TIMEOUT = 10
+# headers of the connection to the front, not of the request itself
+_HOP_HEADERS = {'host', 'content-length', 'connection', 'keep-alive', 'transfer-encoding'}
+# the body of a response is passed already decoded by httpx
+_RESPONSE_SKIPPED_HEADERS = _HOP_HEADERS | {'content-encoding'}
+# paths served by the workers to the front only, the front never passes requests to them
+INTERNAL_PREFIX = '/internal/'
+UPDATE_PATH = INTERNAL_PREFIX + 'update/'
+# header carrying the secret shared by the front and the workers
+SECRET_HEADER = 'x-worker-secret'
+
+
+def worker_urls() -> list[str]:
+    """
+    Returns base URLs of the workers: WORKER_URLS (comma separated) if it is set,
+    otherwise WORKERS local workers listening on ports starting from WORKER_BASE_PORT.
+    """
+    urls = os.getenv('WORKER_URLS')
+    if urls:
+        return [url.strip().rstrip('/') for url in urls.split(',') if url.strip()]
+    base_port = int(os.getenv('WORKER_BASE_PORT', 5001))
+    return [f'http://127.0.0.1:{base_port + i}' for i in range(int(os.getenv('WORKERS', 2)))]
+
+
+def worker_secret() -> str:
+    """
+    Returns WORKER_SECRET: workers accept forwarded updates only with it.
+    """
+    secret = os.getenv('WORKER_SECRET')
+    if not secret:
+        raise RuntimeError('WORKER_SECRET must be set for the front and the workers')
+    return secret
+
+
+def lobby_key(lobby_id: int) -> str:
+    return f'lobby:{lobby_id}'
+
+
+def user_key(tg_id: int) -> str:
+    return f'user:{tg_id}'
+
+
+class Router:
+    """
+    Decides which worker serves an update or a request. A lobby is owned by the worker of its id
+    on the hash ring, a user in a lobby is served by the owner of the lobby and a user out of lobbies
+    by the worker of its own id, so that dialogs like creating a lobby stay in one process.
+    """
+
+    def __init__(self, urls: list[str], secret: str):
+        self.ring = HashRing(urls)
+        self.__secret = secret
+        self.__client: Optional[httpx.AsyncClient] = None
+
+    def client(self) -> httpx.AsyncClient:
+        if self.__client is None:
+            # requests like pick_stone are answered only when the move ends
+            self.__client = httpx.AsyncClient(timeout=httpx.Timeout(_CONNECT_TIMEOUT, read=None))
+        return self.__client
+
+    async def close(self) -> None:
+        if self.__client is not None:
+            await self.__client.aclose()
+            self.__client = None
+
+    def owner_of_lobby(self, lobby_id: int) -> str:
+        return self.ring.node_for(lobby_key(lobby_id))
+
+    async def owner_of_user(self, tg_id: int) -> str:
+        result = await do_request("""SELECT current_lobby_id FROM public.\"user\" WHERE tg_id = %s;""",
+                                  (tg_id,), prepare=True)
+        if result and result[0][0] is not None:
+            return self.owner_of_lobby(result[0][0])
+        return self.ring.node_for(user_key(tg_id))
+
+    async def owner_of_update(self, update: Update) -> str:
+        event = update.event
+        if isinstance(event, CallbackQuery) and event.data and event.data.startswith('enter '):
+            # a user enters a lobby in the process owning it
+            return self.owner_of_lobby(int(event.data.split()[1]))
+        user = getattr(event, 'from_user', None)
+        if user is None:
+            return self.ring.nodes[0]
+        return await self.owner_of_user(user.id)
+
+    async def owner_of_request(self, request: HTTPConnection) -> str:
+        params = request.query_params
+        if 'lobby_id' in params:
+            return self.owner_of_lobby(int(params['lobby_id']))
+        if 'agent_id' in params:
+            return await self.owner_of_user(int(params['agent_id']))
+        return self.ring.nodes[0]
+
+    async def forward_update(self, update: Update) -> None:
+        """
+        Sends the update to its worker. Updates are forwarded one by one, so every worker
+        gets the updates of a user in the order they came.
+        """
+        url = await self.owner_of_update(update)
+        try:
+            response = await self.client().post(url + UPDATE_PATH,
+                                                 content=update.model_dump_json(exclude_unset=True),
+                                                 headers={'content-type': 'application/json',
+                                                          SECRET_HEADER: self.__secret})
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logging.error(f'Failed to forward update {update.update_id} to {url}: {e}')
+
+    async def poll(self, bot: Bot) -> None:
+        """
+        Receives updates from Telegram and forwards them to the workers until cancelled.
+        """
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=_POLL_TIMEOUT)
+            except Exception as e:
+                logging.error(f'Failed to get updates: {e}')
+                await asyncio.sleep(_RETRY_DELAY)
+                continue
+            for update in updates:
+                await self.forward_update(update)
+                offset = update.update_id + 1
+
+    async def proxy(self, request: Request) -> Response:
+        """
+        Passes a request to the agent API to the worker owning its lobby.
+        """
+        if request.url.path.startswith(INTERNAL_PREFIX):
+            return Response(status_code=404)
+        try:
+            url = await self.owner_of_request(request)
+        except ValueError:
+            return Response(status_code=422)
+        headers = {name: value for name, value in request.headers.items() if name not in _HOP_HEADERS}
+        try:
+            response = await self.client().request(request.method, url + request.url.path,
+                                                   params=request.query_params, headers=headers,
+                                                   content=await request.body())
+        except httpx.HTTPError as e:
+            logging.error(f'Failed to pass {request.url.path} to {url}: {e}')
+            return Response(status_code=502)
+        return Response(content=response.content, status_code=response.status_code,
+                        headers={name: value for name, value in response.headers.items()
+                                 if name not in _RESPONSE_SKIPPED_HEADERS})
+
+    async def proxy_websocket(self, websocket: WebSocket) -> None:
+        """
+        Connects a WebSocket of an agent to the worker owning its lobby and passes messages both ways
+        until one of the sides closes the connection.
+        """
+        if websocket.url.path.startswith(INTERNAL_PREFIX):
+            await websocket.close(code=1008)
+            return
+        try:
+            url = await self.owner_of_request(websocket)
+        except ValueError:
+            await websocket.close(code=1008)
+            return
+        url = 'ws' + url.removeprefix('http') + websocket.url.path
+        if websocket.url.query:
+            url += '?' + websocket.url.query
+        try:
+            worker = await websockets.connect(url, open_timeout=_CONNECT_TIMEOUT)
+        except (OSError, websockets.WebSocketException) as e:
+            logging.error(f'Failed to pass {websocket.url.path} to {url}: {e}')
+            await websocket.close(code=1011)
+            return
+        await websocket.accept()
+
+        async def to_worker():
+            while True:
+                await worker.send(await websocket.receive_text())
+
+        async def to_agent():
+            async for message in worker:
+                await websocket.send_text(message)
+
+        tasks = [asyncio.create_task(to_worker()), asyncio.create_task(to_agent())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await worker.close()
+        try:
+            await websocket.close()
+        except RuntimeError:
+            # the agent has already closed the connection
+            pass
+
+
+def front_app(router: Router) -> FastAPI:
+    """
+    Returns the API of the front process: every request is passed to a worker as is.
+    """
+    app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+
+    @app.api_route('/{path:path}', methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+    async def proxy(request: Request) -> Response:
+        return await router.proxy(request)
+
+    @app.websocket('/{path:path}')
+    async def proxy_websocket(websocket: WebSocket) -> None:
+        await router.proxy_websocket(websocket)
+
+    app.add_event_handler('shutdown', router.close)
+    return app
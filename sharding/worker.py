@@ -0,0 +1,38 @@
+"""
+Module providing the endpoint through which a worker process gets updates forwarded by the front process.
+"""
+from aiogram.types import Update
+from fastapi import APIRouter, HTTPException, Request
+
+import asyncio
+import hmac
+import logging
+
+from app.game import bot, dp
+from .router import SECRET_HEADER, UPDATE_PATH, worker_secret
+
+router = APIRouter()
+_secret = worker_secret().encode()
+_tasks: set[asyncio.Task] = set()
+
+
+async def _handle(update: Update) -> None:
+    try:
+        await dp.feed_update(bot, update)
+    except Exception as e:
+        logging.error(f'Failed to handle update {update.update_id}: {e}')
+
+
+@router.post(UPDATE_PATH, include_in_schema=False)
+async def feed_update(request: Request) -> dict:
+    """
+    Accepts an update and handles it in background: handlers like starting a game run for a whole round.
+    Only the front knows the secret, so updates can't be forged by anyone reaching the worker.
+    """
+    if not hmac.compare_digest(request.headers.get(SECRET_HEADER, '').encode(), _secret):
+        raise HTTPException(status_code=403)
+    update = Update.model_validate_json(await request.body(), context={'bot': bot})
+    task = asyncio.create_task(_handle(update))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return {'ok': True}
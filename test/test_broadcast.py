@@ -0,0 +1,44 @@
+import asyncio
+
+from aiogram.methods import SendMessage
+
+from app.broadcast import Broadcaster, TokenBucket
+from test.mocked_bot import MockedBot
+from test.utils import TEST_MESSAGE
+
+
+class TestTokenBucket:
+    def test_reserve(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert 0.05 < bucket.reserve() <= 0.1
+        assert 0.15 < bucket.reserve() <= 0.2
+
+
+class TestBroadcaster:
+    def test_broadcast(self):
+        bot = MockedBot()
+        for _ in range(5):
+            bot.add_result_for(SendMessage, ok=True, result=TEST_MESSAGE)
+
+        async def scenario():
+            broadcaster = Broadcaster(global_rate=100, chat_rate=100, max_concurrent=2)
+            return await broadcaster.broadcast(bot, [SendMessage(chat_id=i, text='test') for i in range(5)])
+
+        assert asyncio.run(scenario()) == 5
+        assert sorted(request.chat_id for request in bot.session.requests) == list(range(5))
+
+    def test_retry_after(self):
+        bot = MockedBot()
+        # responses are taken from the end
+        bot.add_result_for(SendMessage, ok=True, result=TEST_MESSAGE)
+        bot.add_result_for(SendMessage, ok=False, error_code=429, description='Too Many Requests', retry_after=1)
+        bot.add_result_for(SendMessage, ok=False, error_code=403, description='Forbidden')
+
+        async def scenario():
+            broadcaster = Broadcaster(global_rate=100, chat_rate=100, max_concurrent=1)
+            return [await broadcaster.send(bot, SendMessage(chat_id=1, text='test')) for _ in range(2)]
+
+        assert asyncio.run(scenario()) == [None, TEST_MESSAGE]
+        assert len(bot.session.requests) == 3
@@ -0,0 +1,22 @@
+import time
+
+from app.cache import TTLCache
+
+
+class TestTTLCache:
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.put(1, 'a')
+        cache.put(2, 'b')
+        assert cache.get(1) == 'a'
+        cache.put(3, 'c')
+        assert cache.get(2) is None
+        assert cache.get(1) == 'a' and cache.get(3) == 'c'
+        assert len(cache) == 2
+
+    def test_expiration(self):
+        cache = TTLCache(maxsize=2, ttl=0.01)
+        cache.put(1, 'a')
+        time.sleep(0.02)
+        assert cache.get(1) is None
+        assert len(cache) == 0
@@ -0,0 +1,65 @@
+import asyncio
+import os
+
+import pytest
+from aiogram.methods import SendDocument
+from aiogram.types import BufferedInputFile, Document
+from dotenv import load_dotenv
+
+from test.utils import TEST_MESSAGE
+
+load_dotenv()
+if not os.getenv('POSTGRES_MAX_CONNECTIONS'):
+    pytest.skip('the database is not configured', allow_module_level=True)
+
+from app.utils import send_document_to_all_users
+from test.mocked_bot import MockedBot
+
+SENT_DOCUMENT = TEST_MESSAGE.model_copy(update={'document': Document(file_id='uploaded', file_unique_id='u')})
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+    def status(self) -> str:
+        return 'player'
+
+
+class FakeLobby:
+    def __init__(self, user_ids: list[int]):
+        self.__users = [FakeUser(user_id) for user_id in user_ids]
+
+    async def users(self) -> list[FakeUser]:
+        return self.__users
+
+    def lobby_id(self) -> int:
+        return 1
+
+
+class TestSendDocument:
+    def test_file_is_uploaded_once(self):
+        bot = MockedBot()
+        for _ in range(3):
+            bot.add_result_for(SendDocument, ok=True, result=SENT_DOCUMENT)
+        document = BufferedInputFile(b'logs', filename='logs.csv')
+
+        asyncio.run(send_document_to_all_users(bot, FakeLobby([1, 2, 3]), document))
+        requests = list(bot.session.requests)
+        assert [request.document for request in requests].count(document) == 1
+        assert requests[0].chat_id == 1
+        assert sorted(request.chat_id for request in requests[1:]) == [2, 3]
+        assert all(request.document == 'uploaded' for request in requests[1:])
+
+    def test_next_recipient_uploads_after_failure(self):
+        bot = MockedBot()
+        # responses are taken from the end
+        bot.add_result_for(SendDocument, ok=True, result=SENT_DOCUMENT)
+        bot.add_result_for(SendDocument, ok=True, result=SENT_DOCUMENT)
+        bot.add_result_for(SendDocument, ok=False, error_code=403, description='Forbidden')
+        document = BufferedInputFile(b'logs', filename='logs.csv')
+
+        asyncio.run(send_document_to_all_users(bot, FakeLobby([1, 2, 3]), document))
+        assert [(request.chat_id, request.document is document) for request in bot.session.requests] == \
+            [(1, True), (2, True), (3, False)]
+        assert bot.session.requests[2].document == 'uploaded'
@@ -0,0 +1,175 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from database.engine import MoveCoordinator, MoveState, LogWriter, StoneNamings
+
+
+class TestMoveState:
+    def test_choices(self):
+        move = MoveState(1, 1, [10, 20, 30])
+        move.choose(10, 2)
+        move.choose(20, 2)
+        move.choose(30, 3)
+        move.choose(30, None)
+        assert move.stone_of(10) == 2
+        assert move.stone_of(30) is None
+        assert move.num_chosen() == 2
+        assert move.choices() == [(10, 2), (20, 2), (30, None)]
+        assert 20 in move and 40 not in move
+
+    def test_unknown_player(self):
+        move = MoveState(1, 1, [10])
+        with pytest.raises(KeyError):
+            move.choose(20, 1)
+
+    @pytest.mark.parametrize(
+            "choices, removed",
+            [[[1, 1, 2], [1]],
+             [[1, 1, 1], []],
+             [[1, 1, 2, 2], [1, 2]],
+             [[None, None, 3], []],
+             [[4, 4, 5], []]]
+    )
+    def test_removed_stones(self, choices, removed):
+        move = MoveState(1, 1, list(range(len(choices))))
+        for player_id, stone_id in enumerate(choices):
+            move.choose(player_id, stone_id)
+        assert move.removed_stones({1, 2, 3}) == removed
+
+    def test_players_by_stone(self):
+        move = MoveState(1, 1, [10, 20, 30, 40])
+        move.choose(30, 2)
+        move.choose(10, 2)
+        move.choose(40, 1)
+        assert move.occupancy(3).tolist() == [1, 1, 2, 0]
+        assert [players.tolist() for players in move.players_by_stone(3)] == [[20], [40], [10, 30], []]
+
+
+class TestMoveCoordinator:
+    def test_decisions_are_counted_once(self):
+        coordinator = MoveCoordinator()
+        coordinator.start_move([10, 20])
+        assert not coordinator.decide(10)
+        assert not coordinator.decide(10)
+        assert coordinator.num_decided() == 1 and not coordinator.has_signal()
+        assert coordinator.decide(20)
+        assert not coordinator.decide(20)
+        assert asyncio.run(coordinator.wait_signal()) == 'chosen'
+        assert not coordinator.has_signal()
+
+    def test_new_move(self):
+        coordinator = MoveCoordinator()
+        coordinator.start_move([10, 20])
+        coordinator.decide(10)
+        coordinator.start_move([10, 20])
+        assert coordinator.num_decided() == 0 and not coordinator.has_decided(10)
+        with pytest.raises(KeyError):
+            coordinator.decide(30)
+
+    def test_signals_of_ended_moves_are_dropped(self):
+        coordinator = MoveCoordinator()
+        coordinator.start_move([10])
+        coordinator.close_move()
+        assert not coordinator.decide(10)
+        coordinator.signal('timeout', coordinator.current_move())
+        coordinator.start_move([10])
+        coordinator.signal('timeout', coordinator.current_move() - 1)
+        coordinator.signal('end')
+        assert asyncio.run(coordinator.wait_signal()) == 'end'
+        assert coordinator.decide(10)
+        assert asyncio.run(coordinator.wait_signal()) == 'chosen'
+
+    def test_reopened_move_keeps_decisions(self):
+        coordinator = MoveCoordinator()
+        coordinator.start_move([10, 20])
+        coordinator.decide(10)
+        move = coordinator.current_move()
+        coordinator.close_move()
+        coordinator.reopen_move()
+        assert coordinator.current_move() == move and coordinator.has_decided(10)
+        assert coordinator.decide(20) and coordinator.num_decided() == 2
+
+    def test_clear_signals(self):
+        coordinator = MoveCoordinator()
+        coordinator.signal('timeout')
+        coordinator.signal('end')
+        coordinator.clear_signals()
+        assert not coordinator.has_signal()
+
+
+class TestLogWriter:
+    def test_flush_keeps_last_choice(self):
+        saved = []
+
+        async def save(round_number, move_number, choices):
+            saved.append((round_number, move_number, sorted(choices)))
+
+        async def scenario():
+            writer = LogWriter(save, delay=60)
+            writer.add(1, 1, 10, 2)
+            writer.add(1, 1, 10, None)
+            writer.add(1, 1, 20, 3)
+            await writer.flush()
+            await writer.flush()
+
+        asyncio.run(scenario())
+        assert saved == [(1, 1, [(10, None), (20, 3)])]
+
+    def test_flush_after_delay(self):
+        saved = []
+
+        async def save(round_number, move_number, choices):
+            saved.append(choices)
+
+        async def scenario():
+            writer = LogWriter(save, delay=0.01)
+            writer.add(1, 1, 10, 2)
+            await asyncio.sleep(0.05)
+
+        asyncio.run(scenario())
+        assert saved == [[(10, 2)]]
+
+    def test_failed_flush_is_retried(self):
+        saved = []
+
+        async def save(round_number, move_number, choices):
+            if not saved:
+                saved.append(None)
+                raise ConnectionError()
+            saved.append(choices)
+
+        async def scenario():
+            writer = LogWriter(save, delay=60)
+            writer.add(1, 1, 10, 2)
+            with pytest.raises(ConnectionError):
+                await writer.flush()
+            await writer.flush()
+
+        asyncio.run(scenario())
+        assert saved == [None, [(10, 2)]]
+
+
+class TestStoneNamings:
+    def test_translation(self):
+        namings = StoneNamings({10: (2, 3, 1), 20: (1, 2, 3)})
+        assert namings.to_fake(10, 1) == 2
+        assert namings.to_real(10, 2) == 1
+        assert namings.to_fake(20, 0) == 0
+        assert namings.to_real(10, [1, 2, 3]).tolist() == [3, 1, 2]
+        for player_id in (10, 20):
+            stones = np.arange(4)
+            assert namings.to_real(player_id, namings.to_fake(player_id, stones)).tolist() == stones.tolist()
+
+    def test_translation_for_many(self):
+        namings = StoneNamings({10: (2, 3, 1), 20: (1, 2, 3), 30: (3, 1, 2)})
+        assert namings.to_fake_many([30, 10], [0, 1, 3]).tolist() == [[0, 3, 2], [0, 2, 1]]
+        with pytest.raises(KeyError):
+            namings.to_fake_many([10, 40], [1])
+
+    @pytest.mark.parametrize("player_id, stone_id", [[30, 1], [10, 4], [10, -1]])
+    def test_unknown(self, player_id, stone_id):
+        namings = StoneNamings({10: (2, 3, 1)})
+        with pytest.raises(KeyError):
+            namings.to_real(player_id, stone_id)
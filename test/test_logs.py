@@ -0,0 +1,76 @@
+import asyncio
+import csv
+import gzip
+import io
+import os
+import sys
+
+import pytest
+from dotenv import load_dotenv
+
+load_dotenv()
+if not os.getenv('POSTGRES_MAX_CONNECTIONS'):
+    pytest.skip('the database is not configured', allow_module_level=True)
+
+from data.exception import ActionException, _PARQUET_UNAVAILABLE, init_exceptions
+from database.query import connection_pool
+from database import wrappers as wr
+
+
+@pytest.fixture(scope='module')
+def run():
+    init_exceptions()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(connection_pool.open(wait=True, timeout=5))
+    except Exception:
+        loop.close()
+        pytest.skip('the database is not available')
+    try:
+        yield loop.run_until_complete
+    finally:
+        loop.run_until_complete(connection_pool.close())
+        loop.close()
+
+
+@pytest.fixture(scope='module')
+def lobby(run):
+    async def play():
+        lobby = await wr.Lobby.make_lobby(3)
+        agents = [await wr.User.add_or_get(9_000_000_000 + i, 'agent') for i in range(2)]
+        for agent in agents:
+            await lobby.join_user(agent)
+        await lobby.start_game()
+        await lobby.start_round()
+        for agent, stone in zip(agents, (1, 2)):
+            await agent.choose_stone(await lobby.real_to_fake_stone_name(agent.id, stone))
+        await lobby.end_move()
+        return lobby
+
+    lobby = run(play())
+    yield lobby
+    run(lobby.delete())
+
+
+class TestExportLogs:
+    def test_csv(self, run, lobby):
+        rows = list(csv.reader(io.StringIO(run(lobby.get_logs('csv')).decode())))
+        assert rows[0] == list(wr._LOG_COLUMNS)
+        # both choices of the first move and the empty rows of the second one
+        assert [row[2:] for row in rows[1:]] == [['1', '1', '1'], ['2', '1', '1'], ['', '1', '2'], ['', '1', '2']]
+
+    def test_csv_gz(self, run, lobby):
+        assert gzip.decompress(run(lobby.get_logs('csv.gz'))) == run(lobby.get_logs('csv'))
+
+    def test_parquet(self, run, lobby):
+        pq = pytest.importorskip('pyarrow.parquet')
+        table = pq.read_table(io.BytesIO(run(lobby.get_logs('parquet'))))
+        assert table.column_names == list(wr._LOG_COLUMNS)
+        assert table.column('stone_id').to_pylist() == [1, 2, None, None]
+        assert table.column('move_number').to_pylist() == [1, 1, 2, 2]
+
+    def test_parquet_without_pyarrow(self, run, lobby, monkeypatch):
+        monkeypatch.setitem(sys.modules, 'pyarrow', None)
+        with pytest.raises(ActionException) as e:
+            run(lobby.get_logs('parquet'))
+        assert e.value.code == _PARQUET_UNAVAILABLE
@@ -0,0 +1,34 @@
+import asyncio
+
+from database.notifier import EventBus
+
+
+class TestEventBus:
+    def test_every_subscriber_gets_events(self):
+        async def scenario():
+            events = EventBus()
+            first, second = events.subscribe(), events.subscribe()
+            events.publish({'type': 'round_started'})
+            events.unsubscribe(second)
+            events.publish({'type': 'move_started'})
+            late = events.subscribe()
+            return ([first.get_nowait(), first.get_nowait()], second.qsize(), late.empty())
+
+        received, second_size, late_empty = asyncio.run(scenario())
+        assert received == [{'type': 'round_started'}, {'type': 'move_started'}]
+        assert second_size == 1
+        assert late_empty
+
+    def test_slow_subscriber_is_dropped(self):
+        async def scenario():
+            events = EventBus(maxsize=2)
+            slow, fast = events.subscribe(), events.subscribe()
+            for i in range(3):
+                events.publish({'type': 'move_started', 'move': i})
+                fast.get_nowait()
+            events.publish({'type': 'move_ended'})
+            return [slow.get_nowait() for _ in range(slow.qsize())], fast.get_nowait()
+
+        slow_events, fast_event = asyncio.run(scenario())
+        assert slow_events == [EventBus.OVERFLOW]
+        assert fast_event == {'type': 'move_ended'}
@@ -0,0 +1,25 @@
+from collections import Counter
+
+import pytest
+
+from sharding.ring import HashRing
+
+
+class TestHashRing:
+    def test_keys_are_spread(self):
+        nodes = [f'http://127.0.0.1:{5001 + i}' for i in range(4)]
+        ring = HashRing(nodes)
+        owners = Counter(ring.node_for(f'lobby:{i}') for i in range(4000))
+        assert set(owners) == set(nodes)
+        assert min(owners.values()) > 600
+
+    def test_adding_node_moves_only_its_keys(self):
+        ring = HashRing(['a', 'b', 'c'])
+        bigger = HashRing(['a', 'b', 'c', 'd'])
+        for i in range(1000):
+            owner = bigger.node_for(f'lobby:{i}')
+            assert owner == 'd' or owner == ring.node_for(f'lobby:{i}')
+
+    def test_no_nodes(self):
+        with pytest.raises(ValueError):
+            HashRing([])
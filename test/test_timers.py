@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from app.timers import TimerService
+
+
+class TestTimerService:
+    def test_schedule_and_cancel(self):
+        fired = []
+
+        async def on_deadline(kind):
+            fired.append(kind)
+
+        async def scenario():
+            timers = TimerService()
+            timers.schedule(1, 'round', 0.01, on_deadline, 'round')
+            timers.schedule(1, 'move', 0.01, fired.append, 'move')
+            timers.schedule(2, 'round', 0.01, fired.append, 'other lobby')
+            assert timers.cancel(1, 'move')
+            assert not timers.cancel(1, 'move')
+            timers.cancel_all(2)
+            await asyncio.sleep(0.2)
+            assert timers.remaining(1, 'round') is None
+
+        asyncio.run(scenario())
+        assert fired == ['round']
+
+    def test_reschedule_replaces(self):
+        fired = []
+
+        async def scenario():
+            timers = TimerService()
+            timers.schedule(1, 'move', 0.01, fired.append, 'first')
+            timers.schedule(1, 'move', 0.02, fired.append, 'second')
+            # the deadline is a float sum, so it may exceed the delay by a rounding error
+            assert timers.remaining(1, 'move') == pytest.approx(0.02, abs=0.01)
+            await asyncio.sleep(0.2)
+
+        asyncio.run(scenario())
+        assert fired == ['second']